@@ -0,0 +1,115 @@
+from gnucash_uk_corptax.govtalk import GovTalkMessage
+import gnucash_uk_corptax.paths as paths
+
+from lxml import etree as ET
+import base64
+import gzip
+import hashlib
+import json
+import os
+
+# Archive of the payloads received by the test service.  Content is stored
+# gzipped once under its SHA-256 hash, so the same accounts submitted many
+# times take the space of one copy, and each submission has a manifest
+# mapping the names of its payloads to their content:
+#
+#   received/objects/3f/3fa4...e1.gz
+#   received/submissions/1E240.json
+#
+# The test service archives submissions in a thread of its own, off the
+# path of requests and validation.  Writes are atomic, so that a service
+# stopped half way through a write leaves nothing behind which looks
+# complete.
+
+class Archive:
+
+    def __init__(self, root):
+        self.root = root
+
+    def object_path(self, digest):
+        return os.path.join(
+            self.root, "objects", digest[:2], digest + ".gz"
+        )
+
+    def manifest_path(self, corr_id):
+        return os.path.join(self.root, "submissions", corr_id + ".json")
+
+    @staticmethod
+    def write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    # Stores content, unless it is already stored, and returns its hash
+    def put(self, data):
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+
+        if not os.path.exists(path):
+            self.write_atomic(path, gzip.compress(data, compresslevel=6))
+
+        return digest
+
+    def get(self, digest):
+        with open(self.object_path(digest), "rb") as f:
+            return gzip.decompress(f.read())
+
+    # Archives a submission's payloads, given as a map from name to bytes,
+    # and returns the manifest
+    def store(self, corr_id, payloads):
+
+        manifest = {
+            "correlation-id": corr_id,
+            "payloads": {
+                name: {"sha256": self.put(data), "size": len(data)}
+                for name, data in payloads.items()
+            }
+        }
+
+        self.write_atomic(
+            self.manifest_path(corr_id),
+            json.dumps(manifest, indent=4).encode("utf-8")
+        )
+
+        return manifest
+
+    def manifest(self, corr_id):
+        with open(self.manifest_path(corr_id), "r") as f:
+            return json.load(f)
+
+    # Content of one of a submission's payloads
+    def payload(self, corr_id, name):
+        entry = self.manifest(corr_id)["payloads"][name]
+        return self.get(entry["sha256"])
+
+    # Archives a submission request, given the message as received: the
+    # message itself, the IRenvelope, and the embedded documents decoded
+    def store_submission(self, corr_id, data):
+        return self.store(corr_id, submission_payloads(data))
+
+def submission_payloads(data):
+
+    payloads = {"govtalk.xml": data}
+
+    msg = GovTalkMessage.decode(data)
+    ire = msg.ir_envelope()
+
+    if ire is None:
+        return payloads
+
+    payloads["ct.xml"] = ET.tostring(ire, xml_declaration=True)
+
+    for elt in paths.computations_document(ire):
+        payloads["comps.html"] = base64.b64decode(elt.text)
+
+    for elt in paths.accounts_document(ire):
+        payloads["accts.html"] = base64.b64decode(elt.text)
+
+    for elt in paths.attachments(ire):
+        fname = os.path.basename(elt.get("Filename", "attachment"))
+        payloads[fname] = base64.b64decode(elt.text)
+
+    return payloads
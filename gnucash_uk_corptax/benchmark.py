@@ -0,0 +1,110 @@
+import math
+import socket
+import subprocess
+import time
+from urllib.parse import urlparse
+
+# Phases of a submission which are timed, in the order they happen
+phases = ["build", "irmark", "submit", "poll", "delete"]
+
+# Latency samples in seconds, by phase
+class Timings:
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, phase, elapsed):
+        self.samples.setdefault(phase, []).append(elapsed)
+
+    def summary(self):
+        return {
+            phase: summarise(self.samples[phase])
+            for phase in phases + sorted(set(self.samples) - set(phases))
+            if phase in self.samples
+        }
+
+# Nearest-rank percentile of sorted samples
+def percentile(samples, p):
+    rank = max(0, math.ceil(p / 100.0 * len(samples)) - 1)
+    return samples[rank]
+
+def summarise(samples):
+
+    samples = sorted(samples)
+
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "min": samples[0],
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": samples[-1],
+    }
+
+# Runs the test service in the background while a benchmark runs.  The
+# service is started in the current directory, which must hold the schema
+# directory, and is ready once it accepts connections on the port of the
+# gateway URL.
+class Emulator:
+
+    def __init__(self, command, url, startup=30):
+        self.command = command
+        self.url = urlparse(url)
+        self.startup = startup
+        self.proc = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+
+        try:
+            self.proc = subprocess.Popen(
+                self.command, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except Exception as e:
+            raise RuntimeError("Could not start test service: %s" % str(e))
+
+        host = self.url.hostname or "localhost"
+        port = self.url.port or 80
+        deadline = time.time() + self.startup
+
+        while True:
+
+            if self.proc.poll() is not None:
+                raise RuntimeError(
+                    "Test service exited with status %d" % self.proc.returncode
+                )
+
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return
+            except OSError:
+                pass
+
+            if time.time() > deadline:
+                self.stop()
+                raise RuntimeError("Test service did not start")
+
+            time.sleep(0.1)
+
+    def stop(self):
+
+        if self.proc is None:
+            return
+
+        self.proc.terminate()
+
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+        self.proc = None
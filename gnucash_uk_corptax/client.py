@@ -0,0 +1,757 @@
+from gnucash_uk_corptax.govtalk import (
+    GovTalkMessage, GovTalkSubmissionError, GovTalkSubmissionPoll,
+    GovTalkSubmissionResponse, GovTalkDeleteRequest
+)
+from gnucash_uk_corptax.corptax import InputBundle, get_govtalk_message
+from gnucash_uk_corptax.inputs import (
+    get_bundle, load_accts, load_comps, load_bundle, schema_problems
+)
+from gnucash_uk_corptax.transport import Transport
+from gnucash_uk_corptax.poller import Poller
+from gnucash_uk_corptax.benchmark import Timings, Emulator
+import gnucash_uk_corptax.journal as journal
+import gnucash_uk_corptax.paths as paths
+import gnucash_uk_corptax.metrics as metrics
+from gnucash_uk_corptax.spans import span, spanned
+
+import asyncio
+import copy
+import json
+import os
+import sys
+import time
+import yaml
+
+# The modes of gnucash-uk-corptax which talk to a gateway: submitting a
+# return, a batch of them, resuming from the journal, and load testing.
+# This is kept apart from the script, and imported only by these modes,
+# as the HTTP client takes a while to import.
+
+# An error response from the gateway, as opposed to a failure to reach it
+class GatewayError(RuntimeError):
+    pass
+
+async def call(transport, req, ep):
+
+    length = req.xml_length()
+
+    with span("call"):
+        status, data = await transport.post(ep, req.iterxml(), length=length)
+
+    metrics.bytes_sent.inc(length)
+    metrics.bytes_received.inc(len(data.encode("utf-8")))
+
+    if status != 200:
+        print(data)
+        raise RuntimeError(
+            "Transaction failed: status=%d" % status
+        )
+
+    with span("decode"):
+        msg = GovTalkMessage.decode(data)
+
+    if isinstance(msg, GovTalkSubmissionError):
+        metrics.gateway_errors.inc(error_number=msg.get("error-number"))
+        print(data)
+        raise GatewayError(msg.get("error-text"))
+
+    return msg
+
+def get_transport(args):
+    return Transport(limit_per_host=args.connections_per_host)
+
+def get_poller(args):
+    return Poller(concurrency=args.poll_concurrency)
+
+def get_journal(args):
+
+    if args.journal is None:
+        return None
+
+    return journal.Journal(args.journal)
+
+# Why a return already in the journal is not submitted again.  --resume
+# can only carry on with a submission the gateway acknowledged.
+def already_submitted(record):
+
+    if record.state in (journal.SUBMITTED, journal.RESPONDED):
+        return (
+            "Already submitted (journal entry %d, state %s, correlation "
+            "ID %s), use --resume to complete it" % (
+                record.id, record.state, record.correlation_id
+            )
+        )
+
+    if record.state == journal.COMPLETED:
+        return (
+            "Already submitted and completed (journal entry %d, "
+            "correlation ID %s)" % (record.id, record.correlation_id)
+        )
+
+    return (
+        "Already submitted (journal entry %d, state %s), but it is not "
+        "known whether the gateway received it" % (record.id, record.state)
+    )
+
+# Records a submission in the journal, refusing to submit the same return
+# again if an earlier submission of it was not rejected.
+def journal_submission(jnl, name, config, params, utr, irmark):
+
+    if jnl is None:
+        return None
+
+    prev = jnl.find_irmark(irmark)
+
+    if len(prev) > 0:
+        raise RuntimeError(already_submitted(prev[0]))
+
+    return jnl.add(
+        name, os.path.abspath(config), params["url"], utr, irmark
+    )
+
+# Marks a journal entry as failed if the submission never reached the
+# gateway, or the gateway rejected it with an error response.  Otherwise
+# the gateway accepted the submission, and --resume can carry on from
+# where it stopped after a transport error or timeout.
+def journal_failure(record, e):
+
+    if record is None:
+        return
+
+    rejected = (
+        record.state == journal.SUBMITTING or
+        record.state == journal.SUBMITTED and isinstance(e, GatewayError)
+    )
+
+    if rejected:
+        record.update(state=journal.FAILED, message=str(e))
+    else:
+        record.update(message=str(e))
+
+async def submit(transport, poller, req, params, log=print, timeout=120,
+                 record=None):
+
+    metrics.submissions_started.inc()
+
+    with span("submit"):
+
+        try:
+            resp = await call(transport, req, params["url"])
+        except:
+            metrics.submissions_failed.inc()
+            raise
+
+        correlation_id = resp.get("correlation-id")
+        endpoint = resp.get("response-endpoint")
+        try:
+            poll = float(resp.get("poll-interval"))
+        except:
+            poll = None
+
+        log("Correlation ID is", correlation_id)
+
+        if record:
+            record.update(
+                state=journal.SUBMITTED, correlation_id=correlation_id,
+                endpoint=endpoint, poll_interval=poll
+            )
+
+        return await complete(
+            transport, poller, params, correlation_id, endpoint, poll,
+            resp=resp, log=log, timeout=timeout, record=record
+        )
+
+# Returns a coroutine function which polls the gateway for the response to
+# a submission, for use with the Poller.
+def submission_poller(transport, params, log=print, record=None):
+
+    async def poll_submission(correlation_id, endpoint):
+
+        if record and endpoint != record.endpoint:
+            record.update(endpoint=endpoint)
+
+        req = GovTalkSubmissionPoll({
+            "username": params["username"],
+            "password": params["password"],
+            "class": "HMRC-CT-CT600",
+            "gateway-test": params["gateway-test"],
+            "correlation-id": correlation_id
+        })
+
+        log("Poll...")
+        return await call(transport, req, endpoint)
+
+    return poll_submission
+
+# Polls for the response to an accepted submission, and then deletes it
+# from the gateway.
+async def complete(transport, poller, params, correlation_id, endpoint, poll,
+                   resp=None, log=print, timeout=120, record=None):
+
+    if not isinstance(resp, GovTalkSubmissionResponse):
+        try:
+            with span("poll_wait"):
+                resp = await poller.wait(
+                    correlation_id, endpoint, poll, timeout,
+                    submission_poller(transport, params, log, record)
+                )
+        except:
+            metrics.submissions_failed.inc()
+            raise
+        correlation_id = resp.get("correlation-id")
+        endpoint = resp.get("response-endpoint")
+
+    messages = []
+
+    sr = resp.get("success-response")
+    for elt in paths.success_messages(sr):
+        log("- Message " + "-" * 68)
+        log(elt.text)
+        messages.append(elt.text)
+    log("-" * 76)
+
+    log("Submission was successful.")
+    metrics.submissions_completed.inc()
+
+    if record:
+        record.update(
+            state=journal.RESPONDED, correlation_id=correlation_id,
+            endpoint=endpoint, message=" ".join(messages)
+        )
+
+    if correlation_id == None or correlation_id == "":
+        log("Completed.")
+        if record:
+            record.update(state=journal.COMPLETED)
+        return correlation_id, messages
+
+    await delete(transport, params, correlation_id, endpoint, log=log)
+
+    if record:
+        record.update(state=journal.COMPLETED)
+
+    return correlation_id, messages
+
+async def delete(transport, params, correlation_id, endpoint, log=print):
+
+    req = GovTalkDeleteRequest({
+        "username": params["username"],
+        "password": params["password"],
+        "class": "HMRC-CT-CT600",
+        "gateway-test": params["gateway-test"],
+        "correlation-id": correlation_id
+    })
+
+    log("Delete request...")
+    await call(transport, req, endpoint)
+
+    log("Completed.")
+
+# Checks a signed message against the schemas, so that an invalid return
+# is turned down here rather than by the gateway after a round trip.  The
+# schema validator is imported only when validating, as it is slow to
+# import.
+@spanned("validate")
+def preflight(req, schema_dir):
+    import gnucash_uk_corptax.validation as validation
+    problems = validation.preflight(req, schema_dir)
+    if problems:
+        raise RuntimeError("Return is not valid: " + "; ".join(problems))
+
+def submit_ct(args):
+
+    bundle = get_bundle(args)
+
+    payloads = []
+    rtn = bundle.get_return(payloads)
+    utr = str(bundle.form_values["ct600"][3])
+
+    req = get_govtalk_message(bundle.params, utr, rtn, payloads)
+
+    req.add_irmark()
+
+    if args.validate:
+        preflight(req, args.schema_dir)
+
+    print("IRmark is", req.get_irmark())
+
+    jnl = get_journal(args)
+    record = journal_submission(
+        jnl, utr, args.config, bundle.params, utr, req.get("irmark")
+    )
+
+    async def doit():
+        async with get_transport(args) as transport, \
+                   get_poller(args) as poller:
+            await submit(
+                transport, poller, req, bundle.params, timeout=args.timeout,
+                record=record
+            )
+
+    try:
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(doit())
+    except Exception as e:
+        journal_failure(record, e)
+        print("Exception:", str(e))
+        raise e
+
+class BatchEntry:
+    pass
+
+def load_manifest(path):
+
+    try:
+        manifest = yaml.safe_load(open(path, "r").read())
+    except Exception as e:
+        raise RuntimeError("Could not read batch manifest: %s" % str(e))
+
+    if not isinstance(manifest, dict) or "companies" not in manifest:
+        raise RuntimeError("Batch manifest must contain a companies list")
+
+    # Paths in the manifest are relative to the manifest itself
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(file):
+        return os.path.join(base, str(file))
+
+    defaults = manifest.get("defaults", {})
+
+    entries = []
+
+    for num, company in enumerate(manifest["companies"]):
+
+        spec = dict(defaults)
+        spec.update(company)
+
+        for key in ["config", "accounts", "computations", "form-values"]:
+            if key not in spec:
+                raise RuntimeError(
+                    "Batch entry %d has no %s" % (num + 1, key)
+                )
+
+        e = BatchEntry()
+        e.name = str(spec.get("name", "company-%d" % (num + 1)))
+        e.config = resolve(spec["config"])
+        e.accounts = resolve(spec["accounts"])
+        e.computations = resolve(spec["computations"])
+        e.form_values = resolve(spec["form-values"])
+        e.attachments = [resolve(a) for a in spec.get("attachments", [])]
+
+        e.utr = ""
+        e.irmark = ""
+        e.correlation_id = ""
+        e.status = "pending"
+        e.message = ""
+        e.elapsed = 0.0
+
+        entries.append(e)
+
+    return manifest, entries
+
+def build_submission(entry, schema_dir=None):
+
+    accts = load_accts(entry.accounts)
+    comps = load_comps(entry.computations)
+
+    problems = schema_problems(accts, comps)
+    if len(problems) > 0:
+        raise RuntimeError(" ".join(problems[0]))
+
+    bundle = load_bundle(
+        entry.config, accts, comps, entry.form_values, entry.attachments
+    )
+
+    payloads = []
+    rtn = bundle.get_return(payloads)
+    utr = str(bundle.form_values["ct600"][3])
+
+    req = get_govtalk_message(bundle.params, utr, rtn, payloads)
+    req.add_irmark()
+
+    if schema_dir:
+        preflight(req, schema_dir)
+
+    return bundle, utr, req
+
+async def submit_entry(transport, poller, jnl, entry, limit, timeout,
+                       schema_dir=None):
+
+    def log(*args):
+        print("[%s]" % entry.name, *args)
+
+    async with limit:
+
+        start = time.time()
+        loop = asyncio.get_event_loop()
+        record = None
+
+        try:
+
+            # Building is CPU-bound, keep it off the event loop so that
+            # other submissions can carry on polling.
+            entry.status = "building"
+            bundle, utr, req = await loop.run_in_executor(
+                None, build_submission, entry, schema_dir
+            )
+            entry.utr = utr
+            entry.irmark = req.get("irmark")
+            log("IRmark is", entry.irmark)
+
+            record = journal_submission(
+                jnl, entry.name, entry.config, bundle.params, utr,
+                entry.irmark
+            )
+
+            entry.status = "submitting"
+            entry.correlation_id, messages = await submit(
+                transport, poller, req, bundle.params, log=log,
+                timeout=timeout, record=record
+            )
+
+            entry.status = "ok"
+            entry.message = " ".join(messages)
+
+        except Exception as e:
+            journal_failure(record, e)
+            log("Exception:", str(e))
+            entry.status = "failed"
+            entry.message = str(e)
+            if record:
+                entry.correlation_id = record.correlation_id
+
+        entry.elapsed = time.time() - start
+
+async def submit_batch(transport, poller, jnl, entries, concurrency,
+                       timeout, schema_dir=None):
+
+    limit = asyncio.Semaphore(concurrency)
+
+    await asyncio.gather(*[
+        submit_entry(
+            transport, poller, jnl, entry, limit, timeout, schema_dir
+        )
+        for entry in entries
+    ])
+
+def output_batch_summary(entries):
+
+    print()
+    print("%-24s %-10s %-8s %-8s %8s  %s" % (
+        "Company", "UTR", "Corr ID", "Status", "Time", "Message"
+    ))
+    print("-" * 76)
+
+    for e in entries:
+        print("%-24s %-10s %-8s %-8s %7.1fs  %s" % (
+            e.name[:24], e.utr[:10], (e.correlation_id or "")[:8],
+            e.status, e.elapsed, e.message[:40]
+        ))
+
+    print("-" * 76)
+
+    ok = len([e for e in entries if e.status == "ok"])
+    print("%d of %d submissions succeeded." % (ok, len(entries)))
+
+def batch_ct(args):
+
+    manifest, entries = load_manifest(args.batch)
+
+    if args.concurrency is not None:
+        concurrency = args.concurrency
+    else:
+        concurrency = int(manifest.get("concurrency", 10))
+
+    if concurrency < 1:
+        raise RuntimeError("Concurrency must be at least 1")
+
+    jnl = get_journal(args)
+
+    # Loaded once here, rather than by whichever builder gets there first,
+    # and shared by all of them
+    schema_dir = None
+    if args.validate:
+        import gnucash_uk_corptax.validation as validation
+        schema_dir = args.schema_dir
+        validation.load_schemas(schema_dir)
+
+    async def doit():
+        async with get_transport(args) as transport, \
+                   get_poller(args) as poller:
+            await submit_batch(
+                transport, poller, jnl, entries, concurrency, args.timeout,
+                schema_dir
+            )
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(doit())
+
+    output_batch_summary(entries)
+
+    if any(e.status != "ok" for e in entries):
+        sys.exit(1)
+
+async def resume_entry(transport, poller, record, entry, limit, timeout):
+
+    def log(*args):
+        print("[%s]" % entry.name, *args)
+
+    async with limit:
+
+        start = time.time()
+
+        try:
+
+            if record.state == journal.SUBMITTING:
+
+                # Can't tell whether the gateway received it, and
+                # resubmitting risks a duplicate return.
+                record.update(state=journal.UNKNOWN)
+                raise RuntimeError(
+                    "Interrupted while submitting, no correlation ID"
+                )
+
+            params = json.loads(open(record.config).read())
+
+            if record.state == journal.SUBMITTED:
+
+                entry.status = "polling"
+                entry.correlation_id, messages = await complete(
+                    transport, poller, params, record.correlation_id,
+                    record.endpoint, record.poll_interval, log=log,
+                    timeout=timeout, record=record
+                )
+                entry.message = " ".join(messages)
+
+            elif record.state == journal.RESPONDED:
+
+                entry.status = "deleting"
+                if record.correlation_id:
+                    await delete(
+                        transport, params, record.correlation_id,
+                        record.endpoint, log=log
+                    )
+                record.update(state=journal.COMPLETED)
+                entry.message = record.message
+
+            entry.status = "ok"
+
+        except Exception as e:
+            if record.state != journal.UNKNOWN:
+                journal_failure(record, e)
+            log("Exception:", str(e))
+            entry.status = "failed"
+            entry.message = str(e)
+
+        entry.elapsed = time.time() - start
+
+def resume_ct(args):
+
+    jnl = get_journal(args)
+
+    if jnl is None:
+        raise RuntimeError("Must specify a journal to resume")
+
+    records = jnl.outstanding()
+
+    if len(records) == 0:
+        print("No outstanding submissions.")
+        return
+
+    entries = []
+    for record in records:
+        e = BatchEntry()
+        e.name = record.name
+        e.utr = record.utr or ""
+        e.irmark = record.irmark
+        e.correlation_id = record.correlation_id or ""
+        e.status = record.state
+        e.message = ""
+        e.elapsed = 0.0
+        entries.append(e)
+
+    async def doit():
+
+        limit = asyncio.Semaphore(args.concurrency or 10)
+
+        async with get_transport(args) as transport, \
+                   get_poller(args) as poller:
+            await asyncio.gather(*[
+                resume_entry(
+                    transport, poller, record, entry, limit, args.timeout
+                )
+                for record, entry in zip(records, entries)
+            ])
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(doit())
+
+    output_batch_summary(entries)
+
+    if any(e.status != "ok" for e in entries):
+        sys.exit(1)
+
+# A synthetic submission for benchmarking: the input return under a
+# numbered company name, so that every submission has its own IRmark.
+def build_synthetic(bundle, num):
+
+    form_values = copy.deepcopy(bundle.form_values)
+    name = form_values["ct600"].get(1) or "Company"
+    form_values["ct600"][1] = "%s (benchmark %d)" % (name, num)
+
+    b = InputBundle(
+        bundle.comps, bundle.accts, form_values, bundle.params, bundle.atts
+    )
+
+    payloads = []
+    rtn = b.get_return(payloads)
+    utr = str(b.form_values["ct600"][3])
+
+    return get_govtalk_message(b.params, utr, rtn, payloads)
+
+def add_irmark(req):
+    req.add_irmark()
+    return req
+
+# Drives one synthetic submission through submit, poll and delete, timing
+# each phase.
+async def benchmark_entry(transport, poller, bundle, num, limit, timeout,
+                          timings, errors):
+
+    def log(*args):
+        pass
+
+    params = bundle.params
+
+    # Counted as submit() counts them: started when sent, and completed or
+    # failed according to whether a response was received
+    pending = False
+
+    async with limit:
+
+        loop = asyncio.get_event_loop()
+
+        try:
+
+            t = time.time()
+            req = await loop.run_in_executor(
+                None, build_synthetic, bundle, num
+            )
+            timings.add("build", time.time() - t)
+
+            t = time.time()
+            await loop.run_in_executor(None, add_irmark, req)
+            timings.add("irmark", time.time() - t)
+
+            metrics.submissions_started.inc()
+            pending = True
+
+            t = time.time()
+            resp = await call(transport, req, params["url"])
+            timings.add("submit", time.time() - t)
+
+            correlation_id = resp.get("correlation-id")
+            endpoint = resp.get("response-endpoint")
+            try:
+                poll = float(resp.get("poll-interval"))
+            except:
+                poll = None
+
+            t = time.time()
+            if not isinstance(resp, GovTalkSubmissionResponse):
+                resp = await poller.wait(
+                    correlation_id, endpoint, poll, timeout,
+                    submission_poller(transport, params, log)
+                )
+                correlation_id = resp.get("correlation-id")
+                endpoint = resp.get("response-endpoint")
+            timings.add("poll", time.time() - t)
+
+            metrics.submissions_completed.inc()
+            pending = False
+
+            if correlation_id:
+                t = time.time()
+                await delete(
+                    transport, params, correlation_id, endpoint, log=log
+                )
+                timings.add("delete", time.time() - t)
+
+            return True
+
+        except Exception as e:
+            if pending:
+                metrics.submissions_failed.inc()
+            errors.append(str(e))
+            return False
+
+# Load test: drives synthetic submissions through the real submit, poll and
+# delete path, by default against a test service started for the run, and
+# outputs throughput and per-phase latency as JSON.
+def benchmark_ct(args):
+
+    if args.benchmark < 1:
+        raise RuntimeError("Benchmark needs at least 1 submission")
+
+    concurrency = args.concurrency or 10
+    if concurrency < 1:
+        raise RuntimeError("Concurrency must be at least 1")
+
+    bundle = get_bundle(args)
+
+    timings = Timings()
+    errors = []
+
+    async def doit():
+        limit = asyncio.Semaphore(concurrency)
+        async with get_transport(args) as transport, \
+                   get_poller(args) as poller:
+            return await asyncio.gather(*[
+                benchmark_entry(
+                    transport, poller, bundle, num + 1, limit, args.timeout,
+                    timings, errors
+                )
+                for num in range(args.benchmark)
+            ])
+
+    def run():
+        loop = asyncio.new_event_loop()
+        start = time.time()
+        results = loop.run_until_complete(doit())
+        return results, time.time() - start
+
+    if args.no_emulator:
+        results, elapsed = run()
+    else:
+        command = emulator_command() + [
+            "--workers", str(args.emulator_workers)
+        ]
+        with Emulator(command, bundle.params["url"]):
+            results, elapsed = run()
+
+    ok = len([r for r in results if r])
+
+    print(json.dumps({
+        "submissions": args.benchmark,
+        "succeeded": ok,
+        "failed": args.benchmark - ok,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": ok / elapsed,
+        "phases": timings.summary(),
+        "errors": sorted(set(errors)),
+    }, indent=4))
+
+    if ok < args.benchmark:
+        sys.exit(1)
+
+# The test service installed alongside the running script
+def emulator_command():
+
+    here = os.path.dirname(os.path.abspath(sys.argv[0]))
+    path = os.path.join(here, "corptax-test-service")
+
+    if os.path.exists(path):
+        return [sys.executable, path]
+
+    return ["corptax-test-service"]
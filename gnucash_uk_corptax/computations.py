@@ -4,6 +4,7 @@ from io import BytesIO
 import ixbrl_parse.ixbrl
 from ixbrl_parse.ixbrl import Period, Instant, Entity, Dimension
 from ixbrl_parse.value import *
+from gnucash_uk_corptax.document import Document
 
 CT_NS = "http://www.hmrc.gov.uk/schemas/ct/comp/2021-01-01"
 CORE_NS = "http://xbrl.frc.org.uk/fr/2021-01-01/core"
@@ -17,11 +18,179 @@ class Definition:
         self.value = v
         return self
 
+# Dimensions used to select contexts
+COMPANY = Dimension(
+    ET.QName(CT_NS, "BusinessTypeDimension"), ET.QName(CT_NS, "Company")
+)
+TRADE = Dimension(
+    ET.QName(CT_NS, "BusinessTypeDimension"), ET.QName(CT_NS, "Trade")
+)
+MANAGEMENT_EXPENSES = Dimension(
+    ET.QName(CT_NS, "BusinessTypeDimension"),
+    ET.QName(CT_NS, "ManagementExpenses")
+)
+POST_LOSS_REFORM = Dimension(
+    ET.QName(CT_NS, "LossReformDimension"),
+    ET.QName(CT_NS, "Post-lossReform")
+)
+TERRITORY_UK = Dimension(
+    ET.QName(CT_NS, "TerritoryDimension"), ET.QName(CT_NS, "UK")
+)
+
+# A fact in the computations: concept name and the Computations method
+# which selects its context
+class Fact:
+    def __init__(self, ns, concept, context):
+        self.name = ET.QName(ns, concept)
+        self.context = context
+
+START = Fact(CT_NS, "StartOfPeriodCoveredByReturn", "company_instant_context")
+END = Fact(CT_NS, "EndOfPeriodCoveredByReturn", "company_instant_context")
+COMPANY_NAME = Fact(CT_NS, "CompanyName", "company_instant_context")
+TAX_REFERENCE = Fact(CT_NS, "TaxReference", "company_instant_context")
+GROSS_PROFIT_LOSS = Fact(CORE_NS, "GrossProfitLoss", "period_context")
+TURNOVER_REVENUE = Fact(CORE_NS, "TurnoverRevenue", "period_context")
+ADJUSTED_TRADING_PROFIT = Fact(
+    CT_NS, "AdjustedTradingProfitOfThisPeriod", "company_period_context"
+)
+NET_TRADING_PROFITS = Fact(
+    CT_NS, "NetTradingProfits", "company_period_context"
+)
+NET_CHARGEABLE_GAINS = Fact(
+    CT_NS, "NetChargeableGains", "company_period_context"
+)
+PROFITS_BEFORE_OTHER_DEDUCTIONS_AND_RELIEFS = Fact(
+    CT_NS, "ProfitsBeforeOtherDeductionsAndReliefs", "company_period_context"
+)
+PROFITS_BEFORE_CHARGES_AND_GROUP_RELIEF = Fact(
+    CT_NS, "ProfitsBeforeChargesAndGroupRelief", "company_period_context"
+)
+TOTAL_PROFITS_CHARGEABLE_TO_CORPORATION_TAX = Fact(
+    CT_NS, "TotalProfitsChargeableToCorporationTax", "company_period_context"
+)
+FY1 = Fact(CT_NS, "FinancialYear1CoveredByTheReturn", "company_period_context")
+FY2 = Fact(CT_NS, "FinancialYear2CoveredByTheReturn", "company_period_context")
+FY1_PROFIT = Fact(
+    CT_NS, "FY1AmountOfProfitChargeableAtFirstRate", "company_period_context"
+)
+FY2_PROFIT = Fact(
+    CT_NS, "FY2AmountOfProfitChargeableAtFirstRate", "company_period_context"
+)
+FY1_TAX_RATE = Fact(CT_NS, "FY1FirstRateOfTax", "company_period_context")
+FY2_TAX_RATE = Fact(CT_NS, "FY2FirstRateOfTax", "company_period_context")
+FY1_TAX = Fact(CT_NS, "FY1TaxAtFirstRate", "company_period_context")
+FY2_TAX = Fact(CT_NS, "FY2TaxAtFirstRate", "company_period_context")
+CORPORATION_TAX_CHARGEABLE = Fact(
+    CT_NS, "CorporationTaxChargeable", "company_period_context"
+)
+TAX_CHARGEABLE = Fact(CT_NS, "TaxChargeable", "company_period_context")
+TAX_PAYABLE = Fact(CT_NS, "TaxPayable", "company_period_context")
+SME_RND_EXPENDITURE_DEDUCTION = Fact(
+    CT_NS,
+    "AdjustmentsAdditionalDeductionForQualifyingRDExpenditureSME",
+    "trade_period_context"
+)
+INVESTMENT_ALLOWANCE = Fact(
+    CT_NS, "MainPoolAnnualInvestmentAllowance", "management_expenses_context"
+)
+
+# CT600 box number to the fact which supplies its value
+boxes = {
+    1: COMPANY_NAME,
+    3: TAX_REFERENCE,
+    30: START,
+    35: END,
+    145: TURNOVER_REVENUE,
+    155: NET_TRADING_PROFITS,
+    165: NET_TRADING_PROFITS,
+    235: PROFITS_BEFORE_OTHER_DEDUCTIONS_AND_RELIEFS,
+    300: PROFITS_BEFORE_CHARGES_AND_GROUP_RELIEF,
+    315: TOTAL_PROFITS_CHARGEABLE_TO_CORPORATION_TAX,
+    330: FY1,
+    335: FY1_PROFIT,
+    340: FY1_TAX_RATE,
+    345: FY1_TAX,
+    380: FY2,
+    385: FY2_PROFIT,
+    390: FY2_TAX_RATE,
+    395: FY2_TAX,
+    430: CORPORATION_TAX_CHARGEABLE,
+    440: CORPORATION_TAX_CHARGEABLE,
+    475: CORPORATION_TAX_CHARGEABLE,
+    510: TAX_CHARGEABLE,
+    525: TAX_PAYABLE,
+    528: TAX_PAYABLE,
+    660: SME_RND_EXPENDITURE_DEDUCTION,
+    670: SME_RND_EXPENDITURE_DEDUCTION,
+    690: INVESTMENT_ALLOWANCE,
+}
+
+# The box table grouped for extraction: context method -> fact name ->
+# boxes
+def compile_plan(boxes):
+
+    plan = {}
+
+    for box, f in boxes.items():
+        plan.setdefault(f.context, {}).setdefault(f.name, []).append(box)
+
+    return plan
+
+plan = compile_plan(boxes)
+
 class Computations:
 
+    # comps is either a Document or the raw iXBRL bytes
     def __init__(self, comps):
-        tree = ET.parse(BytesIO(comps))
-        self.ixbrl = ixbrl_parse.ixbrl.parse(tree)
+        if isinstance(comps, Document):
+            self.ixbrl = comps.ixbrl()
+        else:
+            tree = ET.parse(BytesIO(comps))
+            self.ixbrl = ixbrl_parse.ixbrl.parse(tree)
+
+        self.index_contexts()
+
+    def index_contexts(self):
+
+        # Walk the context tree once.  Find the period context with the
+        # latest end date, the instant context with the latest date and
+        # the entity context.
+        self.p_ctxt = None
+        self.i_ctxt = None
+        self.e_ctxt = None
+        p_t = None
+        i_t = None
+
+        for rel, ctxt, lvl in self.ixbrl.context_iter():
+            if isinstance(rel, Period):
+                if not p_t or rel.end > p_t:
+                    p_t = rel.end
+                    self.p_ctxt = ctxt
+            elif isinstance(rel, Instant):
+                if not i_t or rel.instant > i_t:
+                    i_t = rel.instant
+                    self.i_ctxt = ctxt
+            elif isinstance(rel, Entity):
+                self.e_ctxt = ctxt
+
+        # Map tuples of dimensions to the contexts beneath the period and
+        # instant contexts
+        self.period_dims = {}
+        self.instant_dims = {}
+
+        if self.p_ctxt is not None:
+            self.index_dimensions(self.p_ctxt, (), self.period_dims)
+
+        if self.i_ctxt is not None:
+            self.index_dimensions(self.i_ctxt, (), self.instant_dims)
+
+    def index_dimensions(self, ctxt, dims, index):
+
+        for rel, child in ctxt.children.items():
+            if isinstance(rel, Dimension):
+                key = dims + (rel,)
+                index[key] = child
+                self.index_dimensions(child, key, index)
 
     def get_context(self, ctxt, rel):
 
@@ -30,325 +199,139 @@ class Computations:
 
         return ctxt.children[rel]
 
+    def dimension_context(self, ctxt, index, dims):
+
+        if dims in index:
+            return index[dims]
+
+        # Not indexed, walk down to report the missing dimension
+        for rel in dims:
+            ctxt = self.get_context(ctxt, rel)
+
+        return ctxt
+
     def value(self, v):
         return v.to_value().get_value()
 
     def period_context(self):
 
-        # Find the period context with the latest end date
-        p_ctxt = None
-        t = None
-        for rel, ctxt, lvl in self.ixbrl.context_iter():
-            if isinstance(rel, Period):
-                if not t or rel.end > t:
-                    t = rel.end
-                    p_ctxt = ctxt
-
-        if p_ctxt is None:
+        if self.p_ctxt is None:
             raise RuntimeError("Expected to find a period context")
 
-        return p_ctxt
+        return self.p_ctxt
 
     def instant_context(self):
 
-        # Find the instant context with the latest date
-        i_ctxt = None
-        t = None
-        for rel, ctxt, lvl in self.ixbrl.context_iter():
-            if isinstance(rel, Instant):
-                if not t or rel.instant > t:
-                    t = rel.instant
-                    i_ctxt = ctxt
-
-        if i_ctxt is None:
+        if self.i_ctxt is None:
             raise RuntimeError("Expected to find an instant context")
 
-        return i_ctxt
+        return self.i_ctxt
 
     def entity_context(self):
 
-        # Find the entity context
-        e_ctxt = None
-        for rel, ctxt, lvl in self.ixbrl.context_iter():
-            if isinstance(rel, Entity):
-                e_ctxt = ctxt
-
-        if e_ctxt is None:
+        if self.e_ctxt is None:
             raise RuntimeError("Expected to find an entity context")
 
-        return e_ctxt
+        return self.e_ctxt
 
     def company_instant_context(self):
-
-        ctxt = self.get_context(
-            self.instant_context(),
-            Dimension(
-                ET.QName(CT_NS, "BusinessTypeDimension"),
-                ET.QName(CT_NS, "Company")
-            )
+        return self.dimension_context(
+            self.instant_context(), self.instant_dims, (COMPANY,)
         )
 
-        return ctxt
-
     def company_period_context(self):
-
-        ctxt = self.get_context(
-            self.period_context(),
-            Dimension(
-                ET.QName(CT_NS, "BusinessTypeDimension"),
-                ET.QName(CT_NS, "Company")
-            )
+        return self.dimension_context(
+            self.period_context(), self.period_dims, (COMPANY,)
         )
 
-        return ctxt
-
     def trade_period_context(self):
-
-        ctxt = self.get_context(
-            self.period_context(),
-            Dimension(
-                ET.QName(CT_NS, "BusinessTypeDimension"),
-                ET.QName(CT_NS, "Trade")
-            )
-        )
-
-        ctxt = self.get_context(
-            ctxt,
-            Dimension(
-                ET.QName(CT_NS, "LossReformDimension"),
-                ET.QName(CT_NS, "Post-lossReform")
-            )
-        )
-
-        ctxt = self.get_context(
-            ctxt,
-            Dimension(
-                ET.QName(CT_NS, "TerritoryDimension"),
-                ET.QName(CT_NS, "UK")
-            )
+        return self.dimension_context(
+            self.period_context(), self.period_dims,
+            (TRADE, POST_LOSS_REFORM, TERRITORY_UK)
         )
-
-        return ctxt
     
     def management_expenses_context(self):
-
-        ctxt = self.get_context(
-            self.period_context(),
-            Dimension(
-                ET.QName(CT_NS, "BusinessTypeDimension"),
-                ET.QName(CT_NS, "ManagementExpenses")
-            )
+        return self.dimension_context(
+            self.period_context(), self.period_dims, (MANAGEMENT_EXPENSES,)
         )
 
-        return ctxt
-
     def start(self):
-        
-        val = self.company_instant_context().values[
-            ET.QName(CT_NS, "StartOfPeriodCoveredByReturn")
-        ]
-
-        return self.value(val)
+        return self.fact(START)
 
     def end(self):
-        
-        val = self.company_instant_context().values[
-            ET.QName(CT_NS, "EndOfPeriodCoveredByReturn")
-        ]
-
-        return self.value(val)
+        return self.fact(END)
 
     def company_name(self):
-        
-        val = self.company_instant_context().values[
-            ET.QName(CT_NS, "CompanyName")
-        ]
-
-        return self.value(val)
+        return self.fact(COMPANY_NAME)
 
     def tax_reference(self):
-        
-        val = self.company_instant_context().values[
-            ET.QName(CT_NS, "TaxReference")
-        ]
-
-        return self.value(val)
+        return self.fact(TAX_REFERENCE)
 
     def company_number(self):
-        
         return self.entity_context().entity.id
 
     def gross_profit_loss(self):
-        
-        val = self.period_context().values[
-            ET.QName(CORE_NS, "GrossProfitLoss")
-        ]
-
-        return self.value(val)
+        return self.fact(GROSS_PROFIT_LOSS)
 
     def turnover_revenue(self):
-        
-        val = self.period_context().values[
-            ET.QName(CORE_NS, "TurnoverRevenue")
-        ]
-
-        return self.value(val)
+        return self.fact(TURNOVER_REVENUE)
 
     def adjusted_trading_profit(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "AdjustedTradingProfitOfThisPeriod")
-        ]
-
-        return self.value(val)
+        return self.fact(ADJUSTED_TRADING_PROFIT)
 
     def net_trading_profits(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "NetTradingProfits")
-        ]
-
-        return self.value(val)
+        return self.fact(NET_TRADING_PROFITS)
 
     def net_chargeable_gains(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "NetChargeableGains")
-        ]
-
-        return self.value(val)
+        return self.fact(NET_CHARGEABLE_GAINS)
 
     def profits_before_other_deductions_and_reliefs(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "ProfitsBeforeOtherDeductionsAndReliefs")
-        ]
-
-        return self.value(val)
+        return self.fact(PROFITS_BEFORE_OTHER_DEDUCTIONS_AND_RELIEFS)
 
     def profits_before_charges_and_group_relief(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "ProfitsBeforeChargesAndGroupRelief")
-        ]
-
-        return self.value(val)
+        return self.fact(PROFITS_BEFORE_CHARGES_AND_GROUP_RELIEF)
 
     def total_profits_chargeable_to_corporation_tax(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "TotalProfitsChargeableToCorporationTax")
-        ]
-
-        return self.value(val)
+        return self.fact(TOTAL_PROFITS_CHARGEABLE_TO_CORPORATION_TAX)
 
     def fy1(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FinancialYear1CoveredByTheReturn")
-        ]
-
-        return self.value(val)
+        return self.fact(FY1)
 
     def fy2(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FinancialYear2CoveredByTheReturn")
-        ]
-
-        return self.value(val)
+        return self.fact(FY2)
 
     def fy1_profit(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FY1AmountOfProfitChargeableAtFirstRate")
-        ]
-
-        return self.value(val)
+        return self.fact(FY1_PROFIT)
 
     def fy2_profit(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FY2AmountOfProfitChargeableAtFirstRate")
-        ]
-
-        return self.value(val)
+        return self.fact(FY2_PROFIT)
 
     def fy1_tax_rate(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FY1FirstRateOfTax")
-        ]
-
-        return self.value(val)
+        return self.fact(FY1_TAX_RATE)
 
     def fy2_tax_rate(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FY2FirstRateOfTax")
-        ]
-
-        return self.value(val)
+        return self.fact(FY2_TAX_RATE)
 
     def fy1_tax(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FY1TaxAtFirstRate")
-        ]
-
-        return self.value(val)
+        return self.fact(FY1_TAX)
 
     def fy2_tax(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "FY2TaxAtFirstRate")
-        ]
-
-        return self.value(val)
+        return self.fact(FY2_TAX)
 
     def corporation_tax_chargeable(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "CorporationTaxChargeable")
-        ]
-
-        return self.value(val)
+        return self.fact(CORPORATION_TAX_CHARGEABLE)
 
     def tax_chargeable(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "TaxChargeable")
-        ]
-
-        return self.value(val)
+        return self.fact(TAX_CHARGEABLE)
 
     def tax_payable(self):
-        
-        val = self.company_period_context().values[
-            ET.QName(CT_NS, "TaxPayable")
-        ]
-
-        return self.value(val)
+        return self.fact(TAX_PAYABLE)
 
     def sme_rnd_expenditure_deduction(self):
-
-        val = self.trade_period_context().values[
-            ET.QName(CT_NS,
-                     "AdjustmentsAdditionalDeductionForQualifyingRDExpenditureSME"
-            )
-        ]
-
-        return self.value(val)
+        return self.fact(SME_RND_EXPENDITURE_DEDUCTION)
 
     def investment_allowance(self):
-
-        val = self.management_expenses_context().values[
-            ET.QName(CT_NS,
-                     "MainPoolAnnualInvestmentAllowance"
-            )
-        ]
-
-        return self.value(val)
+        return self.fact(INVESTMENT_ALLOWANCE)
 
     def type_of_company(self):
         return 6
@@ -365,16 +348,61 @@ class Computations:
     def estimated_figures(self):
         return False
 
+    def fact(self, f):
+        return self.value(getattr(self, f.context)().values[f.name])
+
+    # Extracts every fact in the box table.  Facts are gathered in one pass
+    # over the values of each context, and any missing facts are reported
+    # together.
+    def box_values(self):
+
+        values = {}
+        missing = []
+
+        for context, names in plan.items():
+
+            try:
+                ctxt = getattr(self, context)()
+            except RuntimeError as e:
+                for name, bxs in names.items():
+                    missing.extend((b, str(e)) for b in bxs)
+                continue
+
+            found = set()
+
+            for name, v in ctxt.values.items():
+                if name in names:
+                    value = self.value(v)
+                    for b in names[name]:
+                        values[b] = value
+                    found.add(name)
+
+            for name, bxs in names.items():
+                if name not in found:
+                    missing.extend((b, name.localname) for b in bxs)
+
+        if len(missing) > 0:
+            raise RuntimeError(
+                "Computations are missing facts: " + ", ".join(
+                    "box %d (%s)" % (b, what) for b, what in sorted(missing)
+                )
+            )
+
+        return values
+
     def to_values(self):
-        return [
-            Definition(1, "Company name").set(self.company_name()),
+
+        values = self.box_values()
+
+        defs = [
+            Definition(1, "Company name"),
             Definition(2, "Company registration number").set(
                 self.company_number()
             ),
-            Definition(3, "Tax reference").set(self.tax_reference()),
+            Definition(3, "Tax reference"),
             Definition(4, "Type of company").set(self.type_of_company()),
-            Definition(30, "Start of return").set(self.start()),
-            Definition(35, "End of return").set(self.end()),
+            Definition(30, "Start of return"),
+            Definition(35, "End of return"),
             Definition(40, "Repayments this period").set(False),
             Definition(50, "Making more than one return now"),
             Definition(55, "Estimated figures"),
@@ -402,17 +430,11 @@ class Computations:
             Definition(141, "CT600K - Restitution"),
             Definition(142, "CT600L - R&D"),
             Definition(143, "CT600M - Freeports"),
-            Definition(145, "Total turnover from trade").set(
-                self.turnover_revenue()
-            ),
+            Definition(145, "Total turnover from trade"),
             Definition(150, "Banks and other financial concerns"),
-            Definition(155, "Trading profits").set(
-                self.net_trading_profits()
-            ),
+            Definition(155, "Trading profits"),
             Definition(160, "Trading losses brought forward against profits"),
-            Definition(165, "Net trading profits").set(
-                self.net_trading_profits()
-            ),
+            Definition(165, "Net trading profits"),
             Definition(170, "Bank, building society or other interest, and profits from non-trading loan relationships"),
             Definition(172, "Box 170 net of carrying back deficit"),
             Definition(175, "Annual payments not otherwise charged to Corporation Tax and from which Income Tax has not been deducted"),
@@ -427,9 +449,7 @@ class Computations:
             Definition(220, "Net chargeable gains"),
             Definition(225, "Losses brought forward against certain investment income"),
             Definition(230, "Non-trade deficits on loan relationships (including interest), and derivative contracts (financial instruments) brought forward set against non-trading profits"),
-            Definition(235, "Profits before other deductions and reliefs").set(
-                self.profits_before_other_deductions_and_reliefs()
-            ),
+            Definition(235, "Profits before other deductions and reliefs"),
             Definition(240, "Losses on unquoted shares"),
             Definition(245, "Management expenses"),
             Definition(250, "UK property business losses for this or previous accounting period"),
@@ -444,44 +464,36 @@ class Computations:
             Definition(295, "Total of deductions and reliefs"),
             Definition(
                 300, "Profits before qualifying donations and group relief"
-            ).set(
-                self.profits_before_charges_and_group_relief()
             ),
             Definition(305, "Qualifying donations"),
             Definition(310, "Group relief"),
             Definition(312, "Group relief for carried forward losses"),
-            Definition(315, "Profits chargeable to Corporation Tax").set(
-                self.total_profits_chargeable_to_corporation_tax()
-            ),
+            Definition(315, "Profits chargeable to Corporation Tax"),
             Definition(320, "Ring fence profits included"),
             Definition(325, "Northern Ireland profits included"),
-            Definition(330, "FY1").set(self.fy1()),
-            Definition(335, "FY1 Profit 1").set(self.fy1_profit()),
-            Definition(340, "FY1 Rate of Tax 1").set(self.fy1_tax_rate()),
-            Definition(345, "FY1 Tax 1").set(self.fy1_tax()),
+            Definition(330, "FY1"),
+            Definition(335, "FY1 Profit 1"),
+            Definition(340, "FY1 Rate of Tax 1"),
+            Definition(345, "FY1 Tax 1"),
             Definition(350, "FY1 Profit 2"),
             Definition(355, "FY1 Rate of Tax 2"),
             Definition(360, "FY1 Tax 2"),
             Definition(365, "FY1 Profit 3"),
             Definition(370, "FY1 Rate of Tax 3"),
             Definition(375, "FY1 Tax 3"),
-            Definition(380, "FY2").set(self.fy2()),
-            Definition(385, "FY2 Profit 1").set(self.fy2_profit()),
-            Definition(390, "FY2 Rate of Tax 1").set(self.fy2_tax_rate()),
-            Definition(395, "FY2 Tax 1").set(self.fy2_tax()),
+            Definition(380, "FY2"),
+            Definition(385, "FY2 Profit 1"),
+            Definition(390, "FY2 Rate of Tax 1"),
+            Definition(395, "FY2 Tax 1"),
             Definition(400, "FY2 Profit 2"),
             Definition(405, "FY2 Rate of Tax 2"),
             Definition(410, "FY2 Tax 2"),
             Definition(415, "FY2 Profit 3"),
             Definition(420, "FY2 Rate of Tax 3"),
             Definition(425, "FY2 Tax 3"),
-            Definition(430, "Corporation Tax").set(
-                self.corporation_tax_chargeable()
-            ),
+            Definition(430, "Corporation Tax"),
             Definition(435, "Marginal relief for ring fence trades"),
-            Definition(440, "Corporation Tax chargeable").set(
-                self.corporation_tax_chargeable()
-            ),
+            Definition(440, "Corporation Tax chargeable"),
             Definition(445, "Community Investment relief"),
             Definition(450, "Double Taxation Relief"),
             Definition(455, "Put an X in box 455 if box 450 includes an underlying Rate relief claim"),
@@ -492,9 +504,7 @@ class Computations:
             Definition(472, "CJRS and Job Support Scheme entitlement"),
             Definition(473, "CJRS overpayment already assessed or voluntary disclosed"),
             Definition(474, "Other Coronavirus overpayments"),
-            Definition(475, "Net Corporation Tax liability").set(
-                self.corporation_tax_chargeable()
-            ),
+            Definition(475, "Net Corporation Tax liability"),
             Definition(480, "Tax payable on loans and arrangements to participators"),
             Definition(485, "Put an X in box 485 if you completed box A70 in the supplementary pages CT600A"),
             Definition(490, "CFC tax payable"),
@@ -502,19 +512,13 @@ class Computations:
             Definition(496, "Bank surcharge payable"),
             Definition(500, "CFC tax and bank Levy payable"),
             Definition(505, "Supplementary charge (ring fence trades) payable"),
-            Definition(510, "Tax chargeable").set(
-                self.tax_chargeable()
-            ),
+            Definition(510, "Tax chargeable"),
             Definition(515, "Income Tax deducted from gross income included in profits"),
             Definition(520, "Income Tax repayable to the company"),
-            Definition(525, "Self-assessment of tax payable before restitution tax and coronavirus support scheme overpayments").set(
-                self.tax_payable()
-            ),
+            Definition(525, "Self-assessment of tax payable before restitution tax and coronavirus support scheme overpayments"),
             Definition(526, "Coronavirus support schemes overpayment now due"),
             Definition(527, "Restitution tax"),
-            Definition(528, "Self-assessment of tax payable").set(
-                self.tax_payable()
-            ),
+            Definition(528, "Self-assessment of tax payable"),
             Definition(530, "Research and Development credit")
             #.set(
 #                self.sme_rnd_expenditure_deduction()
@@ -552,19 +556,13 @@ class Computations:
             Definition(647, "Eat Out to Help Out Scheme: reimbursed discounts included as taxable income"),
             Definition(650, "Put an X in box 650 if the claim is made by a small or medium-sized enterprise (SME), including a SME subcontractor to a large company").set(True),
             Definition(655, "Put an X in box 655 if the claim is made by a large company"),
-            Definition(660, "R&D enhanced expenditure").set(
-                self.sme_rnd_expenditure_deduction()
-            ),
+            Definition(660, "R&D enhanced expenditure"),
             Definition(665, "Creative enhanced expenditure"),
-            Definition(670, "R&D and creative enhanced expenditure").set(
-                self.sme_rnd_expenditure_deduction()
-            ),
+            Definition(670, "R&D and creative enhanced expenditure"),
             Definition(675, "R&D enhanced expenditure of a SME on work sub contracted to it by a large company"),
             Definition(680, "Vaccines research expenditure"),
             Definition(685, "Enter the total enhanced expenditure"),
-            Definition(690, "Annual investment allowance").set(
-                self.investment_allowance()
-            ),
+            Definition(690, "Annual investment allowance"),
             Definition(691, "Machinery/plant super-deduction — Capital allowances"),
             Definition(692, "Machinery/plant super-deduction — Balancing charges"),
             Definition(693, "Machinery and plant — special rate allowance — Capital allowances"),
@@ -673,3 +671,8 @@ class Computations:
             Definition(985, "Status"),
         ]
 
+        for d in defs:
+            if d.box in values:
+                d.set(values[d.box])
+
+        return defs
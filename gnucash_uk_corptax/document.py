@@ -0,0 +1,53 @@
+from lxml import etree as ET
+from io import BytesIO
+import ixbrl_parse.ixbrl
+from gnucash_uk_corptax.spans import spanned
+
+ns = {
+    "link": "http://www.xbrl.org/2003/linkbase",
+    "xlink": "http://www.w3.org/1999/xlink",
+    "ix": "http://www.xbrl.org/2013/inlineXBRL"
+}
+
+# An iXBRL input document.  The file is read once and parsed once, and
+# the raw bytes (for embedding in the return), the parsed tree (for
+# schema checks and fact extraction) and the iXBRL instance are all
+# shared from here.
+class Document:
+
+    def __init__(self, data):
+        self.data = data
+        self.tree = ET.parse(BytesIO(data))
+        self.instance = None
+
+    @staticmethod
+    @spanned("load")
+    def load(path, kind="iXBRL"):
+
+        try:
+            data = open(path, "rb").read()
+        except Exception as e:
+            raise RuntimeError("Could not read %s file: %s" % (kind, str(e)))
+
+        try:
+            return Document(data)
+        except Exception as e:
+            raise RuntimeError(
+                "Could not parse %s file: %s" % (kind, str(e))
+            )
+
+    def schemas(self):
+
+        schema = set()
+
+        for elt in self.tree.findall(".//ix:references/link:schemaRef", ns):
+            schema.add(elt.get("{%s}href" % ns["xlink"]))
+
+        return schema
+
+    def ixbrl(self):
+
+        if self.instance is None:
+            self.instance = ixbrl_parse.ixbrl.parse(self.tree)
+
+        return self.instance
@@ -0,0 +1,479 @@
+import collections
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+import yaml
+
+# Gateway behaviour for the test service, loaded from a YAML profile.  With
+# no profile the service behaves as it always has: a response is ready 4
+# seconds after submission, the poll interval is 1 second, and there are
+# no rate limits or errors.
+#
+#   seed: 1234
+#   processing-delay:
+#     distribution: lognormal
+#     median: 6
+#     sigma: 0.5
+#   poll-interval:
+#     mode: remaining
+#     min: 1
+#     max: 10
+#   rate-limit:
+#     rate: 5
+#     burst: 10
+#   errors:
+#     recoverable: 0.02
+#     fatal: 0.01
+
+# Error responses, as (number, type, text)
+busy_error = (
+    "1003", "recoverable",
+    "The gateway is busy, please try again later"
+)
+recoverable_error = (
+    "1002", "recoverable",
+    "The submission of this document has failed due to an internal "
+    "system error, please try again later"
+)
+fatal_error = (
+    "3001", "fatal",
+    "The submission of this document has failed due to departmental "
+    "specific business logic in the Body tag"
+)
+
+# A random delay in seconds.  The spec is a number (a fixed delay) or a
+# map with a distribution and its parameters.
+class Distribution:
+
+    def __init__(self, spec, rng):
+
+        self.rng = rng
+
+        if isinstance(spec, (int, float)):
+            spec = {"distribution": "fixed", "value": spec}
+
+        if not isinstance(spec, dict):
+            raise RuntimeError("Delay must be a number or a distribution")
+
+        self.kind = spec.get("distribution", "fixed")
+
+        def param(name, default=None):
+            if name not in spec and default is None:
+                raise RuntimeError(
+                    "%s distribution needs %s" % (self.kind, name)
+                )
+            return float(spec.get(name, default))
+
+        if self.kind == "fixed":
+            self.value = param("value")
+        elif self.kind == "uniform":
+            self.min = param("min")
+            self.max = param("max")
+        elif self.kind == "exponential":
+            self.mean = param("mean")
+        elif self.kind == "normal":
+            self.mean = param("mean")
+            self.sd = param("sd")
+        elif self.kind == "lognormal":
+            self.median = param("median")
+            self.sigma = param("sigma")
+        else:
+            raise RuntimeError("Unknown distribution: %s" % self.kind)
+
+    def sample(self):
+
+        if self.kind == "fixed":
+            return self.value
+        if self.kind == "uniform":
+            return self.rng.uniform(self.min, self.max)
+        if self.kind == "exponential":
+            return self.rng.expovariate(1 / self.mean)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(self.mean, self.sd))
+        if self.kind == "lognormal":
+            return self.rng.lognormvariate(math.log(self.median), self.sigma)
+
+# The PollInterval returned with acknowledgements.  The spec is a number
+# (fixed), or a map with a mode:
+#   fixed:     value
+#   remaining: the time until the response is ready, between min and max
+#   backlog:   min plus per-submission seconds for each outstanding
+#              submission, up to max
+class PollInterval:
+
+    def __init__(self, spec):
+
+        if isinstance(spec, (int, float)):
+            spec = {"mode": "fixed", "value": spec}
+
+        if not isinstance(spec, dict):
+            raise RuntimeError("Poll interval must be a number or a map")
+
+        self.mode = spec.get("mode", "fixed")
+
+        if self.mode not in ["fixed", "remaining", "backlog"]:
+            raise RuntimeError("Unknown poll interval mode: %s" % self.mode)
+
+        self.value = float(spec.get("value", 1))
+        self.min = float(spec.get("min", 1))
+        self.max = float(spec.get("max", 60))
+        self.per_submission = float(spec.get("per-submission", 0.1))
+
+    def get(self, remaining, outstanding):
+
+        if self.mode == "fixed":
+            return self.value
+
+        if self.mode == "remaining":
+            interval = remaining
+        else:
+            interval = self.min + self.per_submission * outstanding
+
+        return min(max(interval, self.min), self.max)
+
+# Per-client token buckets: each client may make rate requests a second on
+# average, with bursts of up to burst requests.
+class RateLimit:
+
+    def __init__(self, spec):
+
+        if not isinstance(spec, dict) or "rate" not in spec:
+            raise RuntimeError("Rate limit needs a rate")
+
+        self.rate = float(spec["rate"])
+        self.burst = float(spec.get("burst", self.rate))
+        self.buckets = {}
+
+    def allow(self, client, now):
+
+        tokens, last = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+        if tokens < 1:
+            self.buckets[client] = (tokens, now)
+            return False
+
+        self.buckets[client] = (tokens - 1, now)
+        return True
+
+class Profile:
+
+    def __init__(self, spec=None):
+
+        if spec is None:
+            spec = {}
+
+        if not isinstance(spec, dict):
+            raise RuntimeError("Gateway profile must be a map")
+
+        known = [
+            "seed", "processing-delay", "poll-interval", "rate-limit",
+            "errors"
+        ]
+        for key in spec:
+            if key not in known:
+                raise RuntimeError("Unknown gateway profile setting: %s" % key)
+
+        self.seed = spec.get("seed")
+        self.rng = random.Random(self.seed)
+
+        self.delay = Distribution(spec.get("processing-delay", 4), self.rng)
+        self.interval = PollInterval(spec.get("poll-interval", 1))
+
+        if "rate-limit" in spec:
+            self.rate_limit = RateLimit(spec["rate-limit"])
+        else:
+            self.rate_limit = None
+
+        errors = spec.get("errors", {})
+        self.recoverable = float(errors.get("recoverable", 0))
+        self.fatal = float(errors.get("fatal", 0))
+
+    @staticmethod
+    def load(path):
+
+        try:
+            spec = yaml.safe_load(open(path, "r").read())
+        except Exception as e:
+            raise RuntimeError("Could not read gateway profile: %s" % str(e))
+
+        return Profile(spec)
+
+    # Each worker process of the service starts from its own seed, so that
+    # they don't all make the same random choices
+    def reseed(self, worker):
+        if self.seed is None:
+            self.rng.seed()
+        else:
+            self.rng.seed(self.seed + worker)
+
+    # Seconds from submission until the response is ready
+    def processing_delay(self):
+        return self.delay.sample()
+
+    # PollInterval attribute value
+    def poll_interval(self, remaining=0, outstanding=0):
+        return "%g" % round(self.interval.get(remaining, outstanding), 3)
+
+    # False if the client has gone over its rate limit
+    def allow(self, client, now):
+        if self.rate_limit is None:
+            return True
+        return self.rate_limit.allow(client, now)
+
+    # True if a request should fail with a recoverable error
+    def recoverable_error(self):
+        return self.rng.random() < self.recoverable
+
+    # True if a submission should be rejected when it has been processed
+    def fatal_error(self):
+        return self.rng.random() < self.fatal
+
+# Correlation IDs are allocated in sequence from here
+first_correlation_id = 123456
+
+# A submission held by the test service.  It is done once it has been
+# checked, after which messages are the messages for the success response,
+# or error says why it could not be processed.
+class Submission:
+
+    def __init__(self, time, ready_at, fatal=False):
+        self.time = time
+        self.ready_at = ready_at
+        self.fatal = fatal
+        self.done = False
+        self.messages = None
+        self.error = None
+
+# Outstanding submissions, by correlation ID.  Clients don't always delete
+# their submissions, so entries which haven't been touched for ttl seconds
+# are expired, and once there are max_size entries the least recently used
+# is evicted to make room.
+class SubmissionStore:
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.next_id = first_correlation_id
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, corr_id):
+        return self.get(corr_id) is not None
+
+    # Entries are kept in order of last use, so expired entries are at the
+    # front
+    def expire(self, now):
+
+        while self.entries:
+            corr_id, (used, s) = next(iter(self.entries.items()))
+            if now - used < self.ttl:
+                break
+            self.discard(corr_id)
+
+    def get(self, corr_id, now=None):
+
+        if now is None:
+            now = time.time()
+
+        self.expire(now)
+
+        if corr_id not in self.entries:
+            return None
+
+        used, s = self.entries[corr_id]
+        self.entries[corr_id] = (now, s)
+        self.entries.move_to_end(corr_id)
+
+        return s
+
+    # Adds a submission, and returns the correlation ID allocated to it
+    def create(self, s, now=None):
+
+        if now is None:
+            now = time.time()
+
+        self.expire(now)
+
+        while len(self.entries) >= self.max_size:
+            self.discard(next(iter(self.entries)))
+
+        corr_id = "%X" % self.next_id
+        self.next_id += 1
+
+        self.entries[corr_id] = (now, s)
+
+        return corr_id
+
+    # Records the outcome of checking a submission
+    def complete(self, corr_id, messages=None, error=None):
+
+        if corr_id not in self.entries:
+            return
+
+        used, s = self.entries[corr_id]
+        s.done = True
+        s.messages = messages
+        s.error = error
+
+    # Validation of a submission which is dropped before it completes isn't
+    # needed any more
+    def discard(self, corr_id):
+        used, s = self.entries.pop(corr_id)
+        validation = getattr(s, "validation", None)
+        if validation is not None:
+            validation.cancel()
+
+shared_schema = """
+CREATE TABLE IF NOT EXISTS submission (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL,
+    ready_at REAL,
+    fatal INTEGER,
+    done INTEGER,
+    messages TEXT,
+    error TEXT,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS submission_used ON submission (used);
+"""
+
+# SubmissionStore kept in an SQLite database, so that the worker processes
+# of the service share it and a poll can be answered by any of them.  The
+# correlation ID is derived from the row ID.  Each process opens its own
+# connection the first time it uses the store.
+class SharedSubmissionStore:
+
+    def __init__(self, path, max_size=10000, ttl=3600):
+
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db = None
+        self.pid = None
+
+        # The connection isn't kept, as it mustn't be carried into the
+        # worker processes
+        with self.connection() as db:
+            db.executescript(shared_schema)
+        self.db.close()
+        self.db = None
+
+    def connection(self):
+
+        if self.db is None or self.pid != os.getpid():
+            try:
+                self.db = sqlite3.connect(self.path, timeout=30)
+                self.db.row_factory = sqlite3.Row
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=OFF")
+            except Exception as e:
+                raise RuntimeError(
+                    "Could not open submission store: %s" % str(e)
+                )
+            self.pid = os.getpid()
+
+        return self.db
+
+    @staticmethod
+    def row_id(corr_id):
+        try:
+            return int(corr_id, 16) - first_correlation_id + 1
+        except:
+            return None
+
+    def __len__(self):
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM submission"
+        ).fetchone()[0]
+
+    def __contains__(self, corr_id):
+        return self.get(corr_id) is not None
+
+    def expire(self, db, now):
+        db.execute(
+            "DELETE FROM submission WHERE used <= ?", (now - self.ttl,)
+        )
+
+    def get(self, corr_id, now=None):
+
+        if now is None:
+            now = time.time()
+
+        id = self.row_id(corr_id)
+        if id is None:
+            return None
+
+        with self.connection() as db:
+
+            self.expire(db, now)
+
+            row = db.execute(
+                "SELECT * FROM submission WHERE id = ?", (id,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            db.execute(
+                "UPDATE submission SET used = ? WHERE id = ?", (now, id)
+            )
+
+        s = Submission(row["time"], row["ready_at"], bool(row["fatal"]))
+        s.done = bool(row["done"])
+        if row["messages"] is not None:
+            s.messages = json.loads(row["messages"])
+        s.error = row["error"]
+
+        return s
+
+    def create(self, s, now=None):
+
+        if now is None:
+            now = time.time()
+
+        with self.connection() as db:
+
+            self.expire(db, now)
+
+            count = db.execute(
+                "SELECT COUNT(*) FROM submission"
+            ).fetchone()[0]
+
+            if count >= self.max_size:
+                db.execute(
+                    "DELETE FROM submission WHERE id IN "
+                    "(SELECT id FROM submission ORDER BY used LIMIT ?)",
+                    (count - self.max_size + 1,)
+                )
+
+            cur = db.execute(
+                "INSERT INTO submission "
+                "(time, ready_at, fatal, done, used) VALUES (?, ?, ?, 0, ?)",
+                (s.time, s.ready_at, int(s.fatal), now)
+            )
+
+        return "%X" % (first_correlation_id + cur.lastrowid - 1)
+
+    def complete(self, corr_id, messages=None, error=None):
+
+        if messages is not None:
+            messages = json.dumps(messages)
+
+        with self.connection() as db:
+            db.execute(
+                "UPDATE submission SET done = 1, messages = ?, error = ? "
+                "WHERE id = ?",
+                (messages, error, self.row_id(corr_id))
+            )
+
+    def discard(self, corr_id):
+        with self.connection() as db:
+            db.execute(
+                "DELETE FROM submission WHERE id = ?", (self.row_id(corr_id),)
+            )
@@ -1,12 +1,15 @@
 
 import gnucash_uk_corptax.irmark as irmark
+from gnucash_uk_corptax.payload import expand, expanded_length
+import gnucash_uk_corptax.paths as paths
+from gnucash_uk_corptax.paths import first
+from gnucash_uk_corptax.spans import span, spanned
 
 import hashlib
 import base64
 from lxml import etree as ET
 import datetime
 import io
-import copy
 import sys
 
 env_ns = "http://www.govtalk.gov.uk/CM/envelope"
@@ -31,6 +34,11 @@ e_Product = "{%s}Product" % env_ns
 e_Version = "{%s}Version" % env_ns
 e_IDAuthentication = "{%s}IDAuthentication" % env_ns
 e_Authentication = "{%s}Authentication" % env_ns
+e_TargetDetails = "{%s}TargetDetails" % env_ns
+e_Organisation = "{%s}Organisation" % env_ns
+e_EmailAddress = "{%s}EmailAddress" % env_ns
+e_Method = "{%s}Method" % env_ns
+e_Role = "{%s}Role" % env_ns
 e_Body = "{%s}Body" % env_ns
 e_ResponseEndPoint = "{%s}ResponseEndPoint" % env_ns
 e_CorrelationID = "{%s}CorrelationID" % env_ns
@@ -45,7 +53,6 @@ e_Location = "{%s}Location" % env_ns
 e_GovTalkErrors = "{%s}GovTalkErrors" % env_ns
 e_Error = "{%s}Error" % env_ns
 e_EnvelopeVersion = "{%s}EnvelopeVersion" % env_ns
-e_Header = "{%s}Header" % env_ns
 
 ct_ns = "http://www.govtalk.gov.uk/taxation/CT/5"
 
@@ -76,9 +83,10 @@ class Message:
 
     def toprettyxml(self):
         msg = self.create_message()
-        return ET.tostring(
+        xml = ET.tostring(
             msg, xml_declaration=True, pretty_print=True, encoding="UTF-8"
-        ).decode("utf-8")
+        )
+        return b"".join(expand(xml, self.payloads())).decode("utf-8")
 
     def tocanonicalxml(self, pre):
         post = io.StringIO()
@@ -86,76 +94,127 @@ class Message:
         return post.getvalue()
 
 class GovTalkMessage(Message):
+
+    # True if decoding needs more of the document than the Header
+    has_body = False
+
     def __init__(self, params=None):
+        self.pending = None
         if params == None:
             self.params = {}
         else:
             self.params = params
 
-    @staticmethod
-    def decode(data):
+    # The built message tree, its serialised form and its IRmark are
+    # cached, so that computing the IRmark, printing and sending share one
+    # construction.  Replacing params, or changing one through set(),
+    # discards them.  Changing the params dict directly does not.
+    @property
+    def params(self):
+        self.load_body()
+        return self._params
 
-        if isinstance(data, str):
-            root = ET.fromstring(data.encode("utf-8"))
-        else:
-            root = ET.fromstring(data)
+    @params.setter
+    def params(self, params):
+        self._params = params
+        self.invalidate()
+
+    def set(self, id, value):
+        self._params[id] = value
+        self.invalidate()
+
+    # Parses the rest of a decoded message, if that hasn't happened yet
+    def load_body(self):
+
+        if self.pending is None:
+            return
+
+        data = self.pending
+        self.pending = None
+        self.decode_body(ET.fromstring(data))
+
+    def decode_xml(self, root):
+        self.decode_header(root)
+        self.decode_body(root)
+
+    def decode_body(self, root):
+        pass
 
-        md = root.find("%s/%s" % (e_Header, e_MessageDetails))
+    def invalidate(self):
+        self.cached_tree = None
+        self.cached_xml = None
+        self.cached_irmark = None
 
-        cls = md.find(e_Class).text
-        qualifier = md.find(e_Qualifier).text
-        function = md.find(e_Function).text
+    # Decodes a message.  Only the Header is parsed to begin with, which is
+    # all that acknowledgements, polls and delete messages need.  For
+    # message types which carry more, the rest of the document is parsed
+    # when a value from it is first asked for.
+    @staticmethod
+    def decode(data):
 
-        if function == "submit" and qualifier == "request":
-            m = GovTalkSubmissionRequest()
-            m.decode_xml(root)
-            return m
+        if isinstance(data, str):
+            data = data.encode("utf-8")
 
-        if function == "submit" and qualifier == "acknowledgement":
-            m = GovTalkSubmissionAcknowledgement()
-            m.decode_xml(root)
-            return m
+        root = parse_header(data)
 
-        if function == "submit" and qualifier == "poll":
-            m = GovTalkSubmissionPoll()
-            m.decode_xml(root)
-            return m
+        md = paths.message_details(root)[0]
 
-        if function == "submit" and qualifier == "error":
-            m = GovTalkSubmissionError()
-            m.decode_xml(root)
-            return m
+        function = first(paths.function, md)
+        qualifier = first(paths.qualifier, md)
 
-        if function == "submit" and qualifier == "response":
-            m = GovTalkSubmissionResponse()
-            m.decode_xml(root)
-            return m
+        if (function, qualifier) not in decoders:
+            raise RuntimeError("Can't decode")
 
-        if function == "delete" and qualifier == "request":
-            m = GovTalkDeleteRequest()
-            m.decode_xml(root)
-            return m
+        m = decoders[(function, qualifier)]()
+        m.decode_header(root)
 
-        if function == "delete" and qualifier == "response":
-            m = GovTalkDeleteResponse()
-            m.decode_xml(root)
-            return m
+        if m.has_body:
+            m.pending = data
 
-        raise RuntimeError("Can't decode")
+        return m
 
     @staticmethod
     def create(cls, params):
         m = cls(params)
         return m
 
+    # Documents which are embedded as base64 when the message is output
+    def payloads(self):
+        return self.get("payloads", [])
+
     def toxml(self):
-        tree = self.create_message()
-        return ET.tostring(
-            tree, xml_declaration=True, encoding="UTF-8"
-        )
+        return b"".join(self.iterxml())
+
+    # Serialised message in pieces, embedded documents are encoded a chunk
+    # at a time
+    def iterxml(self):
+        return expand(self.serialise(), self.payloads())
+
+    def xml_length(self):
+        return expanded_length(self.serialise(), self.payloads())
 
+    # Serialised message, with payload tokens in place of embedded documents
+    def serialise(self):
+
+        if self.cached_xml is None:
+            with span("serialise"):
+                self.cached_xml = ET.tostring(
+                    self.create_message(), xml_declaration=True,
+                    encoding="UTF-8"
+                )
+
+        return self.cached_xml
+
+    # Returns the message tree, which is shared and should not be modified
     def create_message(self):
 
+        if self.cached_tree is None:
+            self.cached_tree = self.build_message()
+
+        return self.cached_tree
+
+    def build_message(self):
+
         root = ET.Element(
             e_GovTalkMessage, nsmap={None: env_ns, "ct": ct_ns}
         )
@@ -166,15 +225,19 @@ class GovTalkMessage(Message):
         self.create_govtalk_details(root)
         self.create_body(root)
 
+        self.apply_irmark(root)
+
+        return ET.ElementTree(root)
+
+    def apply_irmark(self, root):
+
         irmark = self.get("irmark")
 
         if irmark:
-            for elt in root.findall(".//" + ct_IRheader):
-                for elt2 in root.findall(".//" + ct_IRmark):
-                    elt2.text = irmark
-                    elt2.set("Type", "generic")
-
-        return ET.ElementTree(root)
+            for ire in paths.ir_envelope(root):
+                for elt in paths.irmark(ire):
+                    elt.text = irmark
+                    elt.set("Type", "generic")
 
     def create_header(self, root):
         header = ET.SubElement(root, e_Header)
@@ -182,8 +245,13 @@ class GovTalkMessage(Message):
         self.create_sender_details(header)
 
     def get(self, id, default=None):
-        if id in self.params:
-            return self.params[id]
+        if id in self._params:
+            return self._params[id]
+
+        self.load_body()
+
+        if id in self._params:
+            return self._params[id]
 
         return default
          
@@ -204,91 +272,78 @@ class GovTalkMessage(Message):
         if irmark != self.params["irmark"]:
             raise RuntimeError("IRmark is invalid")
 
+    # The IRmark is not part of its own digest, so adding it updates the
+    # cached tree rather than discarding it.
+    @spanned("add_irmark")
     def add_irmark(self):
-        self.params["irmark"] = self.get_irmark()
-
-    def get_irmark(self):
 
-        doc = self.create_message()
-        root = doc.getroot()
-        body = root.find(e_Body)
-        bc = copy.deepcopy(body)
+        irmark = self.get_irmark()
+        self._params["irmark"] = irmark
 
-        # Magic happens, the xmlns is already in place?
-        # bc.set("xmlns", env_ns)
+        if self.cached_tree is not None:
+            self.apply_irmark(self.cached_tree.getroot())
+        self.cached_xml = None
 
-        # Remove IRmark elements
-        for hdr in bc.findall(".//" + ct_IRheader):
-            for mark in hdr.findall(ct_IRmark):
-                hdr.remove(mark)
+    # The Body is canonicalised straight into the digest, skipping the
+    # IRmark, rather than copied, edited and serialised first.
+    def get_irmark(self):
 
-        pre = io.BytesIO()
-        ET.ElementTree(bc).write(pre, encoding="utf-8", xml_declaration=False)
-        i = irmark.compute(pre.getvalue())
+        if self.cached_irmark is None:
+            doc = self.create_message()
+            body = paths.body(doc.getroot())[0]
+            self.cached_irmark = irmark.digest(body, self.payloads())
 
-        return i
+        return self.cached_irmark
 
 class GovTalkSubmissionRequest(GovTalkMessage):
+
+    has_body = True
+
     def __init__(self, params=None):
         super().__init__(params)
         self.params["function"] = "submit"
         self.params["qualifier"] = "request"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
-        sender = header.find(e_SenderDetails)
-        ida = sender.find(e_IDAuthentication)
-        self.params["username"] = sender.find(e_SenderID)
-        auth = ida.find(e_Authentication)
-        self.params["password"] = auth.find(e_Value).text
-        gtd = root.find(e_GovTalkDetails)
-        self.params["tax-reference"] = gtd.find(e_Keys).find(e_Key).text
-        self.params["vendor-id"] = gtd.find(e_ChannelRouting).find(e_Channel).find(e_URI).text
-        self.params["software"] = gtd.find(e_ChannelRouting).find(e_Channel).find(e_Product).text
-        self.params["software-version"] = gtd.find(e_ChannelRouting).find(e_Channel).find(e_Version).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
+        self.params["username"] = first(paths.sender_id, root)
+        self.params["password"] = first(paths.password, root)
 
-        try:
-            self.params["timestamp"] = datetime.datetime.fromisoformat(
-                gtd.find(e_ChannelRouting).find(e_Timestamp).text
-            )
-        except:
-            pass
+        email = first(paths.email, root)
+        if email is not None:
+            self.params["email"] = email
 
-        body = root.find(e_Body)
-        ire = body.find(ct_IRenvelope)
-        self.params["ir-envelope"] = ire
+        gateway_test = first(paths.gateway_test, md)
+        if gateway_test is not None:
+            self.params["gateway-test"] = gateway_test
 
-        try:
-            ts = root.find(e_Timestamp).text
-            self.params["timestamp"] = datetime.datetime.fromisoformat(ts)
-        except:
-            pass
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["email"] = sender.find(e_EmailAddress).text
-        except: pass
+        self.params["audit-id"] = first(paths.audit_id, md, "")
 
-        try:
-            self.params["gateway-test"] = md.find(e_GatewayTest).text
-        except: pass
+    def decode_body(self, root):
+        self.params["tax-reference"] = first(paths.tax_reference, root)
+        ch = paths.channel(root)[0]
+        self.params["vendor-id"] = first(paths.channel_uri, ch)
+        self.params["software"] = first(paths.channel_product, ch)
+        self.params["software-version"] = first(paths.channel_version, ch)
 
         try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
+            self.params["timestamp"] = datetime.datetime.fromisoformat(
+                first(paths.routing_timestamp, root)
+            )
         except:
-            self.params["transaction-id"] = ""
+            pass
 
-        try:
-            self.params["audit-id"] = md.find(e_AuditID).text
-        except:
-            self.params["audit-id"] = ""
+        ire = first(paths.ir_envelope, root)
+        self.params["ir-envelope"] = ire
 
-        for elt in root.findall(".//" + ct_IRheader):
-            for elt2 in root.findall(".//" + ct_IRmark):
-                self.params["irmark"] = elt2.text
+        if ire is not None:
+            for elt in paths.irmark(ire):
+                self.params["irmark"] = elt.text
 
     def create_govtalk_details(self, root):
 
@@ -299,35 +354,35 @@ class GovTalkSubmissionRequest(GovTalkMessage):
         key = ET.SubElement(keys, e_Key, Type="UTR")
         key.text = self.get("tax-reference")
 
-        td = ET.SubElement(gtd, "TargetDetails")
-        ET.SubElement(td, "Organisation").text = "HMRC"
+        td = ET.SubElement(gtd, e_TargetDetails)
+        ET.SubElement(td, e_Organisation).text = "HMRC"
 
-        cr = ET.SubElement(gtd, "ChannelRouting")
-        ch = ET.SubElement(cr, "Channel")
-        ET.SubElement(ch, "URI").text = self.get("vendor-id")
-        ET.SubElement(ch, "Product").text = self.get("software")
-        ET.SubElement(ch, "Version").text = self.get("software-version")
+        cr = ET.SubElement(gtd, e_ChannelRouting)
+        ch = ET.SubElement(cr, e_Channel)
+        ET.SubElement(ch, e_URI).text = self.get("vendor-id")
+        ET.SubElement(ch, e_Product).text = self.get("software")
+        ET.SubElement(ch, e_Version).text = self.get("software-version")
         try:
             timestamp = self.get("timestamp").isoformat()
-            ET.SubElement(cr, "Timestamp").text = timestamp
+            ET.SubElement(cr, e_Timestamp).text = timestamp
         except:
             pass
               
     def create_sender_details(self, root):
 
-        sd = ET.SubElement(root, "SenderDetails")
+        sd = ET.SubElement(root, e_SenderDetails)
 
-        ids = ET.SubElement(sd, "IDAuthentication")
+        ids = ET.SubElement(sd, e_IDAuthentication)
 
-        ET.SubElement(ids, "SenderID").text = self.get("username")
+        ET.SubElement(ids, e_SenderID).text = self.get("username")
 
-        auth = ET.SubElement(ids, "Authentication")
-        ET.SubElement(auth, "Method").text = "clear"
-        ET.SubElement(auth, "Role").text = "principal"
-        ET.SubElement(auth, "Value").text = self.get("password")
+        auth = ET.SubElement(ids, e_Authentication)
+        ET.SubElement(auth, e_Method).text = "clear"
+        ET.SubElement(auth, e_Role).text = "principal"
+        ET.SubElement(auth, e_Value).text = self.get("password")
 
         if self.get("email", "") != "":
-            ET.SubElement(ids, "EmailAddress").text = self.get("email")
+            ET.SubElement(ids, e_EmailAddress).text = self.get("email")
 
     def create_message_details(self, root):
 
@@ -336,10 +391,10 @@ class GovTalkSubmissionRequest(GovTalkMessage):
         ET.SubElement(md, e_Class).text = self.get("class")
         ET.SubElement(md, e_Qualifier).text = self.get("qualifier")
         ET.SubElement(md, e_Function).text = self.get("function")
-        ET.SubElement(md, "TransactionID").text = self.get("transaction-id")
-        ET.SubElement(md, "CorrelationID")
-        ET.SubElement(md, "Transformation").text = "XML"
-        ET.SubElement(md, "GatewayTest").text = self.get("gateway-test", "0")
+        ET.SubElement(md, e_TransactionID).text = self.get("transaction-id")
+        ET.SubElement(md, e_CorrelationID)
+        ET.SubElement(md, e_Transformation).text = "XML"
+        ET.SubElement(md, e_GatewayTest).text = self.get("gateway-test", "0")
 
 class GovTalkSubmissionAcknowledgement(GovTalkMessage):
     def __init__(self, params=None):
@@ -347,53 +402,48 @@ class GovTalkSubmissionAcknowledgement(GovTalkMessage):
         self.params["function"] = "submit"
         self.params["qualifier"] = "acknowledgement"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
 
-        try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
-        except:
-            self.params["transaction-id"] = ""
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["correlation-id"] = md.find(e_CorrelationID).text
-        except:
-            self.params["correlation-id"] = ""
+        self.params["correlation-id"] = first(paths.correlation_id, md, "")
 
-        rep = md.find(e_ResponseEndPoint)
+        rep = paths.response_endpoint(md)[0]
         self.params["poll-interval"] = rep.get("PollInterval")
         self.params["response-endpoint"] = rep.text
 
     def create_govtalk_details(self, root):
 
-        gtd = ET.SubElement(root, "GovTalkDetails")
-        ET.SubElement(gtd, "Keys")
+        gtd = ET.SubElement(root, e_GovTalkDetails)
+        ET.SubElement(gtd, e_Keys)
               
     def create_sender_details(self, root):
 
-        ET.SubElement(root, "SenderDetails")
+        ET.SubElement(root, e_SenderDetails)
 
     def create_message_details(self, root):
 
         md = ET.SubElement(root, e_MessageDetails)
 
-        ET.SubElement(md, "Class").text = self.get("class")
-        ET.SubElement(md, "Qualifier").text = self.get("qualifier")
-        ET.SubElement(md, "Function").text = self.get("function")
-        ET.SubElement(md, "TransactionID").text = self.get("transaction-id", "")
-        ET.SubElement(md, "CorrelationID").text = self.get("correlation-id", "")
-        ET.SubElement(md, "Transformation").text = "XML"
-        ET.SubElement(md, "GatewayTest").text = self.get("gateway-test", "0")
+        ET.SubElement(md, e_Class).text = self.get("class")
+        ET.SubElement(md, e_Qualifier).text = self.get("qualifier")
+        ET.SubElement(md, e_Function).text = self.get("function")
+        ET.SubElement(md, e_TransactionID).text = \
+            self.get("transaction-id", "")
+        ET.SubElement(md, e_CorrelationID).text = \
+            self.get("correlation-id", "")
+        ET.SubElement(md, e_Transformation).text = "XML"
+        ET.SubElement(md, e_GatewayTest).text = self.get("gateway-test", "0")
         ET.SubElement(
-            md, "ResponseEndPoint", PollInterval=self.get("poll-interval")
+            md, e_ResponseEndPoint, PollInterval=self.get("poll-interval")
         ).text = self.get("response-endpoint")
 
     def create_body(self, root):
-        ET.SubElement(root, "Body")
+        ET.SubElement(root, e_Body)
 
 class GovTalkSubmissionPoll(GovTalkMessage):
     def __init__(self, params=None):
@@ -401,27 +451,20 @@ class GovTalkSubmissionPoll(GovTalkMessage):
         self.params["function"] = "submit"
         self.params["qualifier"] = "poll"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
 
-        try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
-        except:
-            self.params["transaction-id"] = ""
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["correlation-id"] = md.find(e_CorrelationID).text
-        except:
-            self.params["correlation-id"] = ""
+        self.params["correlation-id"] = first(paths.correlation_id, md, "")
 
     def create_govtalk_details(self, root):
 
-        gtd = ET.SubElement(root, "GovTalkDetails")
-        ET.SubElement(gtd, "Keys")
+        gtd = ET.SubElement(root, e_GovTalkDetails)
+        ET.SubElement(gtd, e_Keys)
               
     def create_sender_details(self, root):
         pass
@@ -430,66 +473,62 @@ class GovTalkSubmissionPoll(GovTalkMessage):
 
         md = ET.SubElement(root, e_MessageDetails)
 
-        ET.SubElement(md, "Class").text = self.get("class")
-        ET.SubElement(md, "Qualifier").text = self.get("qualifier")
-        ET.SubElement(md, "Function").text = self.get("function")
-        ET.SubElement(md, "TransactionID").text = self.get("transaction-id", "")
-        ET.SubElement(md, "CorrelationID").text = self.get("correlation-id", "")
-        ET.SubElement(md, "Transformation").text = "XML"
-        ET.SubElement(md, "GatewayTest").text = self.get("gateway-test", "0")
+        ET.SubElement(md, e_Class).text = self.get("class")
+        ET.SubElement(md, e_Qualifier).text = self.get("qualifier")
+        ET.SubElement(md, e_Function).text = self.get("function")
+        ET.SubElement(md, e_TransactionID).text = \
+            self.get("transaction-id", "")
+        ET.SubElement(md, e_CorrelationID).text = \
+            self.get("correlation-id", "")
+        ET.SubElement(md, e_Transformation).text = "XML"
+        ET.SubElement(md, e_GatewayTest).text = self.get("gateway-test", "0")
 
     def create_body(self, root):
         pass
 
 class GovTalkSubmissionError(GovTalkMessage):
+
+    has_body = True
+
     def __init__(self, params=None):
         super().__init__(params)
         self.params["function"] = "submit"
         self.params["qualifier"] = "error"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
 
-        try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
-        except:
-            self.params["transaction-id"] = ""
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["correlation-id"] = md.find(e_CorrelationID).text
-        except:
-            self.params["correlation-id"] = ""
+        self.params["correlation-id"] = first(paths.correlation_id, md, "")
 
-        rep = md.find(e_ResponseEndPoint)
+        rep = paths.response_endpoint(md)[0]
         self.params["poll-interval"] = rep.get("PollInterval")
         self.params["response-endpoint"] = rep.text
 
-        gtd = root.find(e_GovTalkDetails)
-        gte = gtd.find(e_GovTalkErrors)
-
+    def decode_body(self, root):
         # Only use first error.
-        e = gte.find(e_Error + "[1]")
-        self.params["error-number"] = e.find(e_Number).text
-        self.params["error-type"] = e.find(e_Type).text
-        self.params["error-text"] = e.find(e_Text).text
-        try:
-            self.params["error-location"] = e.find(e_Location).text
-        except:
-            pass
+        e = paths.first_error(root)[0]
+        self.params["error-number"] = first(paths.error_number, e)
+        self.params["error-type"] = first(paths.error_type, e)
+        self.params["error-text"] = first(paths.error_text, e)
+
+        location = first(paths.error_location, e)
+        if location is not None:
+            self.params["error-location"] = location
 
     def create_govtalk_details(self, root):
 
-        gtd = ET.SubElement(root, "GovTalkDetails")
+        gtd = ET.SubElement(root, e_GovTalkDetails)
 
-        keys = ET.SubElement(root, "Keys")
+        ET.SubElement(gtd, e_Keys)
 
-        gte = ET.SubElement(gtd, "GovTalkErrors")
+        gte = ET.SubElement(gtd, e_GovTalkErrors)
 
-        err = ET.SubElement(gte, "Error")
+        err = ET.SubElement(gte, e_Error)
 
         ET.SubElement(err, e_RaisedBy).text = "Gateway"
         ET.SubElement(err, e_Number).text = self.get("error-number")
@@ -519,42 +558,38 @@ class GovTalkSubmissionError(GovTalkMessage):
         pass
 
 class GovTalkSubmissionResponse(GovTalkMessage):
+
+    has_body = True
+
     def __init__(self, params=None):
         super().__init__(params)
         self.params["function"] = "submit"
         self.params["qualifier"] = "response"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
 
-        try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
-        except:
-            self.params["transaction-id"] = ""
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["correlation-id"] = md.find(e_CorrelationID).text
-        except:
-            self.params["correlation-id"] = ""
+        self.params["correlation-id"] = first(paths.correlation_id, md, "")
 
-        rep = md.find(e_ResponseEndPoint)
+        rep = paths.response_endpoint(md)[0]
         self.params["poll-interval"] = rep.get("PollInterval")
         self.params["response-endpoint"] = rep.text
 
-        body = root.find(e_Body)
-        sr = body.find(".//" + sr_SuccessResponse)
+    def decode_body(self, root):
+        sr = first(paths.success_response, root)
         self.params["success-response"] = sr
 
     def create_govtalk_details(self, root):
-        gtd = ET.SubElement(root, "GovTalkDetails")
-        ET.SubElement(gtd, "Keys")
+        gtd = ET.SubElement(root, e_GovTalkDetails)
+        ET.SubElement(gtd, e_Keys)
               
     def create_sender_details(self, root):
-        ET.SubElement(root, "SenderDetails")
+        ET.SubElement(root, e_SenderDetails)
 
     def create_message_details(self, root):
 
@@ -572,7 +607,7 @@ class GovTalkSubmissionResponse(GovTalkMessage):
         ).text = self.get("response-endpoint")
 
     def create_body(self, root):
-        body = ET.SubElement(root, "Body")
+        body = ET.SubElement(root, e_Body)
         body.append(self.params["success-response"])
 
 class GovTalkDeleteRequest(GovTalkMessage):
@@ -581,26 +616,19 @@ class GovTalkDeleteRequest(GovTalkMessage):
         self.params["function"] = "delete"
         self.params["qualifier"] = "request"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
 
-        try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
-        except:
-            self.params["transaction-id"] = ""
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["correlation-id"] = md.find(e_CorrelationID).text
-        except:
-            self.params["correlation-id"] = ""
+        self.params["correlation-id"] = first(paths.correlation_id, md, "")
 
     def create_govtalk_details(self, root):
-        gtd = ET.SubElement(root, "GovTalkDetails")
-        ET.SubElement(gtd, "Keys")
+        gtd = ET.SubElement(root, e_GovTalkDetails)
+        ET.SubElement(gtd, e_Keys)
               
     def create_sender_details(self, root):
         pass
@@ -609,13 +637,15 @@ class GovTalkDeleteRequest(GovTalkMessage):
 
         md = ET.SubElement(root, e_MessageDetails)
 
-        ET.SubElement(md, "Class").text = self.get("class")
-        ET.SubElement(md, "Qualifier").text = self.get("qualifier")
-        ET.SubElement(md, "Function").text = self.get("function")
-        ET.SubElement(md, "TransactionID").text = self.get("transaction-id", "")
-        ET.SubElement(md, "CorrelationID").text = self.get("correlation-id", "")
-        ET.SubElement(md, "Transformation").text = "XML"
-        ET.SubElement(md, "GatewayTest").text = self.get("gateway-test", "0")
+        ET.SubElement(md, e_Class).text = self.get("class")
+        ET.SubElement(md, e_Qualifier).text = self.get("qualifier")
+        ET.SubElement(md, e_Function).text = self.get("function")
+        ET.SubElement(md, e_TransactionID).text = \
+            self.get("transaction-id", "")
+        ET.SubElement(md, e_CorrelationID).text = \
+            self.get("correlation-id", "")
+        ET.SubElement(md, e_Transformation).text = "XML"
+        ET.SubElement(md, e_GatewayTest).text = self.get("gateway-test", "0")
 
     def create_body(self, root):
         pass
@@ -626,33 +656,26 @@ class GovTalkDeleteResponse(GovTalkMessage):
         self.params["function"] = "delete"
         self.params["qualifier"] = "response"
 
-    def decode_xml(self, root):
-        header = root.find(e_Header)
-        md = header.find(e_MessageDetails)
-        self.params["class"] = md.find(e_Class).text
-        self.params["function"] = md.find(e_Function).text
-        self.params["qualifier"] = md.find(e_Qualifier).text
+    def decode_header(self, root):
+        md = paths.message_details(root)[0]
+        self.params["class"] = first(paths.message_class, md)
+        self.params["function"] = first(paths.function, md)
+        self.params["qualifier"] = first(paths.qualifier, md)
 
-        try:
-            self.params["transaction-id"] = md.find(e_TransactionID).text
-        except:
-            self.params["transaction-id"] = ""
+        self.params["transaction-id"] = first(paths.transaction_id, md, "")
 
-        try:
-            self.params["correlation-id"] = md.find(e_CorrelationID).text
-        except:
-            self.params["correlation-id"] = ""
+        self.params["correlation-id"] = first(paths.correlation_id, md, "")
 
-        rep = md.find(e_ResponseEndPoint)
+        rep = paths.response_endpoint(md)[0]
         self.params["poll-interval"] = rep.get("PollInterval")
         self.params["response-endpoint"] = rep.text
 
     def create_govtalk_details(self, root):
-        gtd = ET.SubElement(root, "GovTalkDetails")
-        ET.SubElement(gtd, "Keys")
+        gtd = ET.SubElement(root, e_GovTalkDetails)
+        ET.SubElement(gtd, e_Keys)
               
     def create_sender_details(self, root):
-        ET.SubElement(root, "SenderDetails")
+        ET.SubElement(root, e_SenderDetails)
 
     def create_message_details(self, root):
 
@@ -671,5 +694,31 @@ class GovTalkDeleteResponse(GovTalkMessage):
         ).text = self.get("response-endpoint")
 
     def create_body(self, root):
-        ET.SubElement(root, "Body")
-
+        ET.SubElement(root, e_Body)
+
+# Message classes by (function, qualifier), used to decode
+decoders = {
+    ("submit", "request"): GovTalkSubmissionRequest,
+    ("submit", "acknowledgement"): GovTalkSubmissionAcknowledgement,
+    ("submit", "poll"): GovTalkSubmissionPoll,
+    ("submit", "error"): GovTalkSubmissionError,
+    ("submit", "response"): GovTalkSubmissionResponse,
+    ("delete", "request"): GovTalkDeleteRequest,
+    ("delete", "response"): GovTalkDeleteResponse,
+}
+
+# Size of the pieces fed to the parser while looking for the Header
+header_chunk = 16384
+
+# Parses a message as far as the end of the Header.  Returns the root
+# element, which has the Header but may have nothing after it.
+def parse_header(data):
+
+    parser = ET.XMLPullParser(events=("end",), tag=e_Header)
+
+    for i in range(0, len(data), header_chunk):
+        parser.feed(data[i:i + header_chunk])
+        for event, elt in parser.read_events():
+            return elt.getparent()
+
+    return parser.close()
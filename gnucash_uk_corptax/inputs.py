@@ -0,0 +1,124 @@
+from gnucash_uk_corptax.computations import Computations
+from gnucash_uk_corptax.corptax import InputBundle
+from gnucash_uk_corptax.document import Document
+from gnucash_uk_corptax.spans import span, spanned
+
+import json
+import sys
+import yaml
+
+# Loading and checking the input files of a return: the accounts and
+# computations iXBRL, the CT600 form values, the configuration and any
+# attachments.
+
+def load_comps(path):
+    return Document.load(path, "computations")
+
+def load_accts(path):
+    return Document.load(path, "accounts")
+
+def schema_problems(accts, comps):
+
+    # Sanity check on inputs, correct schemas in use?
+
+    schema = accts.schemas()
+    found_frc=False
+    found_dpl=False
+    found_ct=False
+
+    for s in schema:
+        if s.startswith("https://xbrl.frc.org.uk/FRS-"):
+            found_frc = True
+        if s.startswith("http://www.hmrc.gov.uk/schemas/ct/dpl/"):
+            found_dpl = True
+
+    schema = comps.schemas()
+
+    for s in schema:
+        if s.startswith("http://www.hmrc.gov.uk/schemas/ct/comp/"):
+            found_ct = True
+        if s.startswith("http://www.hmrc.gov.uk/schemas/ct/dpl/"):
+            found_dpl = True
+
+    problems = []
+
+    if not found_dpl:
+        problems.append([
+            "No DPL schema present in either file!",
+            "One of the files should contain DPL schema statement."
+        ])
+
+    if not found_frc:
+        problems.append([
+            "No FRS schema present in company accounts!",
+            "Is it a company accounts file?"
+        ])
+
+    if not found_ct:
+        problems.append([
+            "No CT schema present in computations file!",
+            "Is it a corporation tax computations file?"
+        ])
+
+    return problems
+
+@spanned("check_schemas")
+def check_schemas(accts, comps):
+
+    problems = schema_problems(accts, comps)
+
+    if len(problems) > 0:
+        for line in problems[0]:
+            sys.stderr.write(line + "\n")
+        sys.exit(1)
+
+@spanned("get_bundle")
+def get_bundle(args):
+
+    if args.config is None:
+        raise RuntimeError("Must specify a config")
+
+    if args.accounts is None:
+        raise RuntimeError("Must specify an accounts file")
+
+    if args.computations is None:
+        raise RuntimeError("Must specify a computations file")
+
+    if args.form_values is None:
+        raise RuntimeError("Must specify a form-values file")
+
+    accts = load_accts(args.accounts)
+    comps = load_comps(args.computations)
+
+    check_schemas(accts, comps)
+
+    return load_bundle(
+        args.config, accts, comps, args.form_values, args.attachment
+    )
+
+# accts and comps are the loaded Documents
+def load_bundle(config, accts, comps, form_values, attachments):
+
+    # Parse the computations now, so that a bad computations file fails here
+    with span("computations"):
+        Computations(comps)
+
+    try:
+        with span("form_values"):
+            form_values = open(form_values, "r").read()
+            form_values = yaml.safe_load(form_values)
+    except Exception as e:
+        raise RuntimeError("Could not read form values file: %s" % str(e))
+
+    # Load config
+    params = json.loads(open(config).read())
+
+    if attachments is not None:
+        atts = {
+            filename: open(filename, "rb").read()
+            for filename in attachments
+        }
+    else:
+        atts = {}
+
+    return InputBundle(comps.data, accts.data, form_values, params, atts)
@@ -1,31 +1,254 @@
 
 import lxml.etree as ET
-import io
-import copy
 import hashlib
 import base64
 import sys
 
-def compute(xml):
+env_ns = "http://www.govtalk.gov.uk/CM/envelope"
+ct_ns = "http://www.govtalk.gov.uk/taxation/CT/5"
 
+ct_IRheader = "{%s}IRheader" % ct_ns
+ct_IRmark = "{%s}IRmark" % ct_ns
 
-    root = ET.fromstring(xml)
-    
-    elt = ET.Element(root.tag, nsmap={
-        None: "http://www.govtalk.gov.uk/CM/envelope",
-        "ct": "http://www.govtalk.gov.uk/taxation/CT/5"
-    })
+# Namespaces declared on the body when the IRmark is computed
+body_nsmap = { None: env_ns, "ct": ct_ns }
 
-    for se in root:
-        elt.append(copy.deepcopy(se))
+def escape_text(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(
+        ">", "&gt;"
+    ).replace("\r", "&#xD;")
 
-    output = io.BytesIO()
-    ET.ElementTree(elt).write_c14n(output)
+def escape_attr(s):
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(
+        '"', "&quot;"
+    ).replace("\t", "&#x9;").replace("\n", "&#xA;").replace("\r", "&#xD;")
 
-#    print(output.getvalue().decode("utf-8"))
-#    raise RuntimeError("ASD")
+def split(tag):
+    if tag[0] == "{":
+        ns, local = tag[1:].split("}", 1)
+        return ns, local
+    return "", tag
 
-    shasum = hashlib.sha1(output.getvalue()).digest()
-    irmark = base64.b64encode(shasum).decode("utf-8")
-    return irmark
+xml_ns = "http://www.w3.org/XML/1998/namespace"
 
+# Namespaces used in a subtree which are declared above it
+def outer_namespaces(elt, outer):
+
+    used = {}
+
+    for e in elt.iter(tag=ET.Element):
+
+        ns, local = split(e.tag)
+        if ns != "" and outer.get(e.prefix) == ns:
+            used[e.prefix] = ns
+
+        for key in e.attrib.keys():
+            ns, local = split(key)
+            prefix = attr_prefix(e, ns)
+            if prefix is not None and outer.get(prefix) == ns:
+                used[prefix] = ns
+
+    return used
+
+# Prefix of a namespaced attribute in the source tree.  Attributes can't
+# use the default namespace, so this is a prefix declared for it, or xml
+# which is never declared.
+def attr_prefix(elt, ns):
+    if ns == xml_ns:
+        return "xml"
+    for prefix, uri in elt.nsmap.items():
+        if uri == ns and prefix is not None:
+            return prefix
+    return None
+
+# Prefix in scope for a namespace URI, the one declared last if there are
+# several, or None if it isn't in scope
+def find_prefix(scope, uri):
+    found = None
+    for prefix, u in scope.items():
+        if u == uri:
+            found = (prefix,)
+    return found
+
+# Feeds canonical text to SHA-1, a buffer at a time
+class Hasher:
+
+    def __init__(self):
+        self.sha = hashlib.sha1()
+        self.buf = []
+        self.size = 0
+
+    def write(self, s):
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size > 65536:
+            self.flush()
+
+    def payload(self, p):
+        self.flush()
+        for chunk in p.chunks():
+            self.sha.update(chunk)
+
+    def flush(self):
+        self.sha.update("".join(self.buf).encode("utf-8"))
+        self.buf = []
+        self.size = 0
+
+    def digest(self):
+        self.flush()
+        return base64.b64encode(self.sha.digest()).decode("utf-8")
+
+# Writes the inclusive canonical XML of an element in the body.
+#
+# The IRmark has always been computed by copying the children of the Body
+# under a new Body declaring the envelope namespace as the default and the
+# CT namespace as ct, and canonicalising that.  Copying with lxml drops
+# any namespace declaration whose URI is already in scope, under whatever
+# prefix, and moves the elements using it onto the prefix in scope.  So an
+# IRenvelope declaring the CT namespace as its default is digested as
+# ct:IRenvelope, and so on.  The same is done here: parent_nsmap is the
+# source namespace scope of the parent, scope is the scope of the output,
+# and prefixes maps source prefixes onto output prefixes where they
+# differ.  decls are namespaces to declare on the element besides those
+# in its nsmap, for the namespaces a child of the Body uses from above it.
+def canonical(elt, parent_nsmap, scope, prefixes, tokens, out, decls=None):
+
+    if elt.tag is ET.Comment:
+        out.write("<!--" + elt.text + "-->")
+        if elt.tail: out.write(escape_text(elt.tail))
+        return
+
+    if elt.tag is ET.PI:
+        if elt.text:
+            out.write("<?" + elt.target + " " + elt.text + "?>")
+        else:
+            out.write("<?" + elt.target + "?>")
+        if elt.tail: out.write(escape_text(elt.tail))
+        return
+
+    nsmap = elt.nsmap
+
+    declared = dict(decls or {})
+    if nsmap != parent_nsmap:
+        for prefix, uri in nsmap.items():
+            if parent_nsmap.get(prefix) != uri:
+                declared[prefix] = uri
+
+    rendered = {}
+
+    if declared:
+
+        scope = dict(scope)
+        prefixes = dict(prefixes)
+
+        for prefix in sorted(declared, key=lambda p: p or ""):
+
+            uri = declared[prefix]
+            found = find_prefix(scope, uri)
+
+            if found is None:
+                scope[prefix] = uri
+                prefixes.pop(prefix, None)
+                rendered[prefix] = uri
+            else:
+                prefixes[prefix] = found[0]
+
+    tag = elt.tag
+    if tag[0] == "{":
+        name = tag[tag.index("}") + 1:]
+        prefix = prefixes.get(elt.prefix, elt.prefix)
+        if prefix:
+            name = prefix + ":" + name
+    else:
+        name = tag
+
+    start = "<" + name
+
+    for prefix in sorted(rendered, key=lambda p: p or ""):
+        if prefix is None:
+            start += ' xmlns="' + escape_attr(rendered[prefix]) + '"'
+        else:
+            start += " xmlns:" + prefix + '="' + \
+                escape_attr(rendered[prefix]) + '"'
+
+    if len(elt.attrib):
+        attrs = []
+        for key, value in elt.attrib.items():
+            ans, alocal = split(key)
+            if ans == "":
+                aname = alocal
+            else:
+                prefix = attr_prefix(elt, ans)
+                if prefix is not None:
+                    prefix = prefixes.get(prefix, prefix)
+                # Can only happen for an attribute in the namespace which
+                # is the default, e.g. the envelope's.  The copy gives it
+                # a prefix declared on the child of the Body, which has
+                # already been written, and the CT schema doesn't allow
+                # such attributes anyway.
+                if prefix is None:
+                    raise RuntimeError(
+                        "Can't compute IRmark: attribute %s:%s is in the "
+                        "default namespace" % (ans, alocal)
+                    )
+                aname = prefix + ":" + alocal
+            attrs.append(((ans, alocal), aname, value))
+        for sortkey, aname, value in sorted(attrs):
+            start += " " + aname + '="' + escape_attr(value) + '"'
+
+    out.write(start + ">")
+
+    text = elt.text
+    if text is not None:
+        if text in tokens:
+            out.payload(tokens[text])
+        else:
+            out.write(escape_text(text))
+
+    is_header = tag == ct_IRheader
+
+    for child in elt:
+
+        # The IRmark itself is excluded
+        if is_header and child.tag == ct_IRmark:
+            continue
+
+        canonical(child, nsmap, scope, prefixes, tokens, out)
+
+    out.write("</" + name + ">")
+
+    if elt.tail:
+        out.write(escape_text(elt.tail))
+
+# Computes the IRmark of a GovTalkMessage Body element.  The canonical
+# form of the body, with IRmark elements removed, is produced directly
+# from the tree and hashed as it is produced.
+def digest(body, payloads=[]):
+
+    tokens = {p.token: p for p in payloads}
+
+    out = Hasher()
+
+    ns, local = split(body.tag)
+    out.write('<%s xmlns="%s" xmlns:ct="%s">' % (local, env_ns, ct_ns))
+
+    outer = {
+        prefix: uri for prefix, uri in body.nsmap.items()
+        if body_nsmap.get(prefix) != uri
+    }
+
+    for child in body:
+
+        # Namespaces declared above the Body are declared on each child
+        # which uses them
+        decls = None
+        if outer and child.tag is not ET.Comment and child.tag is not ET.PI:
+            decls = outer_namespaces(child, outer)
+
+        canonical(
+            child, body.nsmap, body_nsmap, {}, tokens, out, decls
+        )
+
+    out.write("</%s>" % local)
+
+    return out.digest()
@@ -0,0 +1,138 @@
+import sqlite3
+import datetime
+
+# Submission states.  A submission is outstanding until it is completed
+# (response received and deleted from the gateway) or failed.
+SUBMITTING = "submitting"
+SUBMITTED = "submitted"
+RESPONDED = "responded"
+COMPLETED = "completed"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+OUTSTANDING = [SUBMITTING, SUBMITTED, RESPONDED]
+
+fields = [
+    "name", "config", "url", "utr", "irmark", "correlation_id", "endpoint",
+    "poll_interval", "state", "message", "created", "updated"
+]
+
+schema = """
+CREATE TABLE IF NOT EXISTS submission (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    config TEXT,
+    url TEXT,
+    utr TEXT,
+    irmark TEXT,
+    correlation_id TEXT,
+    endpoint TEXT,
+    poll_interval REAL,
+    state TEXT,
+    message TEXT,
+    created TEXT,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS submission_irmark ON submission (irmark);
+CREATE INDEX IF NOT EXISTS submission_state ON submission (state);
+"""
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+class JournalEntry:
+
+    def __init__(self, journal, row):
+        self.journal = journal
+        self.id = row["id"]
+        for f in fields:
+            setattr(self, f, row[f])
+
+    def update(self, **kwargs):
+
+        for key, value in kwargs.items():
+            if key not in fields:
+                raise RuntimeError("Not a journal field: " + key)
+            setattr(self, key, value)
+
+        self.updated = now()
+        kwargs["updated"] = self.updated
+
+        self.journal.update(self.id, kwargs)
+
+# Durable record of submissions.  Each state change is committed before
+# the next gateway interaction, so that a run which is interrupted can be
+# resumed from the journal without submitting again.
+class Journal:
+
+    def __init__(self, path):
+        try:
+            self.db = sqlite3.connect(path)
+            self.db.row_factory = sqlite3.Row
+            with self.db:
+                self.db.executescript(schema)
+        except Exception as e:
+            raise RuntimeError("Could not open journal: %s" % str(e))
+
+    def close(self):
+        self.db.close()
+
+    def add(self, name, config, url, utr, irmark):
+
+        t = now()
+
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO submission "
+                "(name, config, url, utr, irmark, state, message, "
+                "created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, config, url, utr, irmark, SUBMITTING, "", t, t)
+            )
+
+        return self.get(cur.lastrowid)
+
+    def update(self, id, values):
+
+        keys = list(values.keys())
+
+        with self.db:
+            self.db.execute(
+                "UPDATE submission SET " +
+                ", ".join("%s = ?" % k for k in keys) +
+                " WHERE id = ?",
+                [values[k] for k in keys] + [id]
+            )
+
+    def get(self, id):
+
+        row = self.db.execute(
+            "SELECT * FROM submission WHERE id = ?", (id,)
+        ).fetchone()
+
+        if row is None:
+            raise RuntimeError("No journal entry %d" % id)
+
+        return JournalEntry(self, row)
+
+    def select(self, where, args):
+        return [
+            JournalEntry(self, row)
+            for row in self.db.execute(
+                "SELECT * FROM submission WHERE " + where + " ORDER BY id",
+                args
+            )
+        ]
+
+    # Submissions which have not reached a final state
+    def outstanding(self):
+        return self.select(
+            "state IN (%s)" % ", ".join("?" * len(OUTSTANDING)),
+            OUTSTANDING
+        )
+
+    # Earlier submissions of the same return which were not rejected
+    def find_irmark(self, irmark):
+        return self.select(
+            "irmark = ? AND state != ?", (irmark, FAILED)
+        )
@@ -0,0 +1,324 @@
+import contextlib
+import http.server
+import math
+import os
+import threading
+
+# Metrics in the OpenMetrics text format, for watching long-running batches
+# and the test service from Prometheus or anything else which reads it.
+# Metrics can be served over HTTP, or written to a textfile periodically
+# (e.g. for the node exporter's textfile collector).
+
+content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"'
+    )
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '%s="%s"' % (k, escape(v)) for k, v in labels
+    ) + "}"
+
+def format_value(v):
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return "%d" % v
+    return repr(float(v))
+
+class Metric:
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        registry.add(self)
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise RuntimeError(
+                "Metric %s has labels %s" % (self.name, ", ".join(self.labels))
+            )
+        return tuple((k, str(labels[k])) for k in self.labels)
+
+    def header(self):
+        return [
+            "# TYPE %s %s" % (self.name, self.type),
+            "# HELP %s %s" % (self.name, escape(self.help)),
+        ]
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        values = self.values
+        if not values and not self.labels:
+            values = {(): 0}
+        return [
+            "%s_total%s %s" % (self.name, format_labels(k), format_value(v))
+            for k, v in sorted(values.items())
+        ]
+
+class Gauge(Metric):
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+    def samples(self):
+        return [
+            "%s%s %s" % (self.name, format_labels(k), format_value(v))
+            for k, v in sorted(self.values.items())
+        ]
+
+# Buckets suited to durations from milliseconds to minutes
+time_buckets = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60, 120, 300
+]
+
+class Histogram(Metric):
+
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=time_buckets):
+        self.buckets = sorted(buckets) + [math.inf]
+        super().__init__(registry, name, help, labels)
+
+    def observe(self, value, **labels):
+
+        key = self.key(labels)
+
+        with self.registry.lock:
+
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+
+            counts, count, total = self.values[key]
+
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    counts[i] += 1
+
+            self.values[key] = [counts, count + 1, total + value]
+
+    def samples(self):
+
+        out = []
+
+        for k, (counts, count, total) in sorted(self.values.items()):
+            for le, n in zip(self.buckets, counts):
+                out.append("%s_bucket%s %d" % (
+                    self.name, format_labels(k + (("le", format_value(le)),)),
+                    n
+                ))
+            out.append("%s_count%s %d" % (self.name, format_labels(k), count))
+            out.append("%s_sum%s %s" % (
+                self.name, format_labels(k), format_value(total)
+            ))
+
+        return out
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+
+    def counter(self, name, help, labels=()):
+        return Counter(self, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return Gauge(self, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=time_buckets):
+        return Histogram(self, name, help, labels, buckets)
+
+    def exposition(self):
+
+        lines = []
+
+        with self.lock:
+            for m in self.metrics:
+                lines.extend(m.header())
+                lines.extend(m.samples())
+
+        lines.append("# EOF")
+
+        return "\n".join(lines) + "\n"
+
+    # Written atomically, so that a reader never sees half a file
+    def write(self, path):
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.exposition())
+        os.replace(tmp, path)
+
+# Serves a registry on /metrics from a thread of its own, so that it
+# answers whatever the event loop is busy with
+class MetricsServer:
+
+    def __init__(self, registry, host, port):
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = http.server.ThreadingHTTPServer(
+                (host, port), Handler
+            )
+        except Exception as e:
+            raise RuntimeError(
+                "Could not listen for metrics on %s:%d: %s" % (
+                    host, port, str(e)
+                )
+            )
+
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Writes a registry to a textfile every interval seconds, and once more
+# when stopped so that the file holds the final values
+class TextfileWriter:
+
+    def __init__(self, registry, path, interval=10):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.registry.write(self.path)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.registry.write(self.path)
+
+def parse_listen(listen):
+
+    host, _, port = listen.rpartition(":")
+
+    try:
+        return host or "localhost", int(port)
+    except:
+        raise RuntimeError("Metrics address should be HOST:PORT: " + listen)
+
+# Exports a registry for the duration of a run: served on listen
+# (HOST:PORT), written to path, either, or neither
+@contextlib.contextmanager
+def exported(registry, listen=None, path=None, interval=10):
+
+    exporters = []
+
+    if listen:
+        host, port = parse_listen(listen)
+        exporters.append(MetricsServer(registry, host, port))
+
+    if path:
+        exporters.append(TextfileWriter(registry, path, interval))
+
+    for e in exporters:
+        e.start()
+
+    try:
+        yield
+    finally:
+        for e in exporters:
+            e.stop()
+
+# Span hook which records the duration of each stage
+class StageMetrics:
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def enter(self, name):
+        pass
+
+    def exit(self, name, elapsed):
+        self.histogram.observe(elapsed, stage=name)
+
+# Metrics of the client
+registry = Registry()
+
+submissions_started = registry.counter(
+    "corptax_submissions_started", "Submissions sent to the gateway"
+)
+submissions_completed = registry.counter(
+    "corptax_submissions_completed",
+    "Submissions which received a successful response"
+)
+submissions_failed = registry.counter(
+    "corptax_submissions_failed", "Submissions which failed"
+)
+gateway_errors = registry.counter(
+    "corptax_gateway_errors", "Error responses from the gateway",
+    ["error_number"]
+)
+polls_per_submission = registry.histogram(
+    "corptax_polls_per_submission",
+    "Polls sent before a submission's response was received",
+    buckets=[0, 1, 2, 3, 5, 10, 20, 50, 100]
+)
+time_to_response = registry.histogram(
+    "corptax_time_to_response_seconds",
+    "Time from a submission's acknowledgement until its response"
+)
+bytes_sent = registry.counter(
+    "corptax_sent_bytes", "Bytes of messages sent to the gateway"
+)
+bytes_received = registry.counter(
+    "corptax_received_bytes", "Bytes of messages received from the gateway"
+)
+stage_duration = registry.histogram(
+    "corptax_stage_duration_seconds", "Duration of each stage of a run",
+    ["stage"]
+)
@@ -0,0 +1,160 @@
+from gnucash_uk_corptax.computations import Computations
+from gnucash_uk_corptax.corptax import InputBundle, get_govtalk_message
+from gnucash_uk_corptax.govtalk import GovTalkMessage
+
+import gc
+import platform
+import statistics
+import time
+import tracemalloc
+
+# Stages of building and decoding a submission which are timed, in the
+# order they happen
+stages = [
+    "computations", "to-values", "get-return", "irmark", "toxml", "decode"
+]
+
+# Inputs to the stages: the computations and accounts iXBRL as bytes, and
+# the form values and configuration
+class Inputs:
+    def __init__(self, comps, accts, form_values, params):
+        self.comps = comps
+        self.accts = accts
+        self.form_values = form_values
+        self.params = params
+
+    def bundle(self):
+        return InputBundle(
+            self.comps, self.accts, self.form_values, self.params, {}
+        )
+
+    def utr(self):
+        return str(self.form_values["ct600"][3])
+
+    def message(self):
+        payloads = []
+        rtn = self.bundle().get_return(payloads)
+        return get_govtalk_message(self.params, self.utr(), rtn, payloads)
+
+# Each stage is a setup function, which is not timed, returning the
+# argument to the timed function.  Stages which would find their result
+# cached are given a fresh object each time.
+def stage_functions(inputs):
+
+    def signed():
+        req = inputs.message()
+        req.add_irmark()
+        return req
+
+    def decoded(data):
+        msg = GovTalkMessage.decode(data)
+        msg.ir_envelope()
+        return msg
+
+    comps = Computations(inputs.comps)
+    data = signed().toxml()
+
+    return {
+        "computations": (lambda: inputs.comps, Computations),
+        "to-values": (lambda: comps, lambda c: c.to_values()),
+        "get-return": (
+            inputs.bundle, lambda b: b.get_return([])
+        ),
+        "irmark": (inputs.message, lambda m: m.get_irmark()),
+        "toxml": (signed, lambda m: m.toxml()),
+        "decode": (lambda: data, decoded),
+    }
+
+def time_stage(setup, fn, repeat):
+
+    samples = []
+
+    for i in range(repeat):
+        arg = setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+# Peak memory allocated while the stage runs, over what its input holds
+def stage_peak(setup, fn):
+
+    arg = setup()
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak - base
+
+# Runs every stage repeat times for timing, and once more with tracemalloc
+# for memory, which would otherwise distort the timings
+def run(inputs, repeat=5):
+
+    results = {}
+
+    for stage, (setup, fn) in stage_functions(inputs).items():
+
+        samples = time_stage(setup, fn, repeat)
+
+        results[stage] = {
+            "wall": statistics.median(samples),
+            "min": min(samples),
+            "max": max(samples),
+            "peak-memory": stage_peak(setup, fn),
+        }
+
+    return results
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+# Measures compared against a baseline
+measures = ["wall", "peak-memory"]
+
+# Compares results against a baseline, both as saved, and returns the
+# comparisons as (scale, stage, measure, baseline, current, change), and
+# whether each is a regression: an increase of more than threshold, as a
+# fraction of the baseline.
+def compare(baseline, results, threshold=0.1):
+
+    comparisons = []
+
+    for scale, stages_run in results["results"].items():
+
+        base_stages = baseline["results"].get(scale, {})
+
+        for stage in stages:
+
+            if stage not in stages_run or stage not in base_stages:
+                continue
+
+            for measure in measures:
+
+                base = base_stages[stage][measure]
+                cur = stages_run[stage][measure]
+
+                if base > 0:
+                    change = (cur - base) / base
+                else:
+                    change = 0.0
+
+                comparisons.append((
+                    (scale, stage, measure, base, cur, change),
+                    change > threshold
+                ))
+
+    return comparisons
@@ -0,0 +1,107 @@
+from lxml import etree as ET
+
+# Precompiled paths into GovTalk messages and CT returns.  Every path is
+# rooted at a known element and names each step, so that looking a value
+# up never scans the descendants of the Body, which can hold megabytes of
+# embedded documents.
+
+env_ns = "http://www.govtalk.gov.uk/CM/envelope"
+ct_ns = "http://www.govtalk.gov.uk/taxation/CT/5"
+sr_ns = "http://www.inlandrevenue.gov.uk/SuccessResponse"
+
+ns = {
+    "env": env_ns,
+    "ct": ct_ns,
+    "sr": sr_ns,
+}
+
+def path(expr):
+    return ET.XPath(expr, namespaces=ns, smart_strings=False)
+
+# First result of a path, or the default if there is none
+def first(xp, elt, default=None):
+    res = xp(elt)
+    if len(res) == 0:
+        return default
+    return res[0]
+
+# Relative to GovTalkMessage
+message_details = path("env:Header/env:MessageDetails")
+sender_id = path(
+    "env:Header/env:SenderDetails/env:IDAuthentication/env:SenderID/text()"
+)
+password = path(
+    "env:Header/env:SenderDetails/env:IDAuthentication/env:Authentication/"
+    "env:Value/text()"
+)
+email = path(
+    "env:Header/env:SenderDetails/env:IDAuthentication/"
+    "env:EmailAddress/text()"
+)
+tax_reference = path("env:GovTalkDetails/env:Keys/env:Key[1]/text()")
+channel = path("env:GovTalkDetails/env:ChannelRouting/env:Channel")
+routing_timestamp = path(
+    "env:GovTalkDetails/env:ChannelRouting/env:Timestamp/text()"
+)
+first_error = path("env:GovTalkDetails/env:GovTalkErrors/env:Error[1]")
+body = path("env:Body")
+ir_envelope = path("env:Body/ct:IRenvelope")
+success_response = path("env:Body/sr:SuccessResponse")
+
+# Relative to MessageDetails
+message_class = path("env:Class/text()")
+function = path("env:Function/text()")
+qualifier = path("env:Qualifier/text()")
+transaction_id = path("env:TransactionID/text()")
+correlation_id = path("env:CorrelationID/text()")
+gateway_test = path("env:GatewayTest/text()")
+audit_id = path("env:AuditID/text()")
+response_endpoint = path("env:ResponseEndPoint")
+
+# Relative to Channel
+channel_uri = path("env:URI/text()")
+channel_product = path("env:Product/text()")
+channel_version = path("env:Version/text()")
+
+# Relative to Error
+error_number = path("env:Number/text()")
+error_type = path("env:Type/text()")
+error_text = path("env:Text/text()")
+error_location = path("env:Location/text()")
+
+# Relative to SuccessResponse
+success_messages = path("sr:Message")
+
+# Relative to IRenvelope
+irmark = path("ct:IRheader/ct:IRmark")
+company_name = path(
+    "ct:CompanyTaxReturn/ct:CompanyInformation/ct:CompanyName/text()"
+)
+reference = path(
+    "ct:CompanyTaxReturn/ct:CompanyInformation/ct:Reference/text()"
+)
+period_from = path(
+    "ct:CompanyTaxReturn/ct:CompanyInformation/ct:PeriodCovered/"
+    "ct:From/text()"
+)
+period_to = path(
+    "ct:CompanyTaxReturn/ct:CompanyInformation/ct:PeriodCovered/"
+    "ct:To/text()"
+)
+turnover = path("ct:CompanyTaxReturn/ct:Turnover/ct:Total/text()")
+chargeable_profits = path(
+    "ct:CompanyTaxReturn/ct:CompanyTaxCalculation/ct:ChargeableProfits/text()"
+)
+tax_payable = path(
+    "ct:CompanyTaxReturn/ct:CalculationOfTaxOutstandingOrOverpaid/"
+    "ct:TaxPayable/text()"
+)
+computations_document = path(
+    "ct:CompanyTaxReturn/ct:AttachedFiles/ct:XBRLsubmission/"
+    "ct:Computation/ct:Instance/ct:EncodedInlineXBRLDocument"
+)
+accounts_document = path(
+    "ct:CompanyTaxReturn/ct:AttachedFiles/ct:XBRLsubmission/"
+    "ct:Accounts/ct:Instance/ct:EncodedInlineXBRLDocument"
+)
+attachments = path("ct:CompanyTaxReturn/ct:AttachedFiles/ct:Attachment")
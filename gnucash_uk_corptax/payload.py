@@ -0,0 +1,63 @@
+import base64
+import uuid
+
+# Raw bytes per base64 chunk, a multiple of 3 so that chunks encode
+# without padding and concatenate to the encoding of the whole document
+chunk_size = 3 * 16384
+
+# A document embedded in a message as base64 text.  The message tree holds
+# a unique token in place of the text, and the base64 is produced a chunk
+# at a time when the message is output, so the encoded document is never
+# held in memory.
+class Payload:
+
+    def __init__(self, data):
+        self.data = data
+        self.token = "payload-" + uuid.uuid4().hex
+
+    def length(self):
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def chunks(self):
+        for i in range(0, len(self.data), chunk_size):
+            yield base64.b64encode(self.data[i:i + chunk_size])
+
+# Takes serialised XML containing payload tokens and yields it in pieces,
+# with each token replaced by its base64 encoded payload.
+def expand(xml, payloads):
+
+    tokens = {p.token.encode("utf-8"): p for p in payloads}
+
+    pos = 0
+
+    while True:
+
+        found = None
+        for token in tokens:
+            at = xml.find(token, pos)
+            if at >= 0 and (found is None or at < found[0]):
+                found = (at, token)
+
+        if found is None:
+            break
+
+        at, token = found
+
+        yield xml[pos:at]
+        for chunk in tokens[token].chunks():
+            yield chunk
+
+        pos = at + len(token)
+
+    yield xml[pos:]
+
+# Length of the expanded XML
+def expanded_length(xml, payloads):
+
+    length = len(xml)
+
+    for p in payloads:
+        count = xml.count(p.token.encode("utf-8"))
+        length += count * (p.length() - len(p.token))
+
+    return length
@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import itertools
+import random
+
+from gnucash_uk_corptax.govtalk import GovTalkSubmissionResponse
+import gnucash_uk_corptax.metrics as metrics
+
+class Pending:
+    pass
+
+# Polls many outstanding submissions from one scheduler.  Submissions are
+# kept in a priority queue ordered by next poll time.  Each is re-polled
+# after the PollInterval most recently returned by the gateway, stretched
+# by a small random jitter so that polls don't all fire together.  Polls
+# are never sent sooner than the gateway asked for.
+class Poller:
+
+    def __init__(self, concurrency=10, jitter=0.1):
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.queue = []
+        self.seq = itertools.count()
+        self.task = None
+        self.polling = set()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def start(self):
+
+        if self.task is not None:
+            return
+
+        self.limit = asyncio.Semaphore(self.concurrency)
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+        for task in list(self.polling):
+            task.cancel()
+
+        for when, seq, p in self.queue:
+            if not p.future.done():
+                p.future.set_exception(RuntimeError("Poller stopped"))
+        self.queue = []
+
+    # Wait until the gateway has a response for a submission.  poll is a
+    # coroutine function called with the correlation ID and endpoint, which
+    # should return the decoded gateway response.  Returns the
+    # GovTalkSubmissionResponse.
+    def wait(self, correlation_id, endpoint, interval, timeout, poll):
+
+        if self.task is None:
+            raise RuntimeError("Poller is not started")
+
+        loop = asyncio.get_event_loop()
+
+        p = Pending()
+        p.correlation_id = correlation_id
+        p.endpoint = endpoint
+        p.poll = poll
+        p.polls = 0
+        p.started = loop.time()
+        p.deadline = p.started + timeout
+        p.future = loop.create_future()
+
+        self.schedule(p, interval)
+
+        return p.future
+
+    def schedule(self, p, interval):
+
+        if interval is None:
+            raise RuntimeError(
+                "Should be polling, but have no poll information?"
+            )
+
+        loop = asyncio.get_event_loop()
+
+        delay = interval * (1 + random.uniform(0, self.jitter))
+        when = min(loop.time() + delay, p.deadline)
+
+        heapq.heappush(self.queue, (when, next(self.seq), p))
+        self.wakeup.set()
+
+    async def run(self):
+
+        loop = asyncio.get_event_loop()
+
+        while True:
+
+            if len(self.queue) == 0:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            delay = self.queue[0][0] - loop.time()
+
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            when, seq, p = heapq.heappop(self.queue)
+
+            if p.future.done():
+                continue
+
+            if loop.time() >= p.deadline:
+                p.future.set_exception(
+                    RuntimeError("Timeout waiting for valid response.")
+                )
+                continue
+
+            await self.limit.acquire()
+            task = asyncio.ensure_future(self.poll_one(p))
+            self.polling.add(task)
+            task.add_done_callback(self.polling.discard)
+
+    async def poll_one(self, p):
+
+        try:
+
+            resp = await p.poll(p.correlation_id, p.endpoint)
+            p.polls += 1
+
+            if p.future.done():
+                return
+
+            if isinstance(resp, GovTalkSubmissionResponse):
+                metrics.polls_per_submission.observe(p.polls)
+                metrics.time_to_response.observe(
+                    asyncio.get_event_loop().time() - p.started
+                )
+                p.future.set_result(resp)
+                return
+
+            p.correlation_id = resp.get("correlation-id")
+            p.endpoint = resp.get("response-endpoint")
+
+            try:
+                interval = float(resp.get("poll-interval"))
+            except:
+                interval = None
+
+            self.schedule(p, interval)
+
+        except Exception as e:
+            if not p.future.done():
+                p.future.set_exception(e)
+
+        finally:
+            self.limit.release()
@@ -0,0 +1,147 @@
+import contextvars
+import functools
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Hooks called around the stages of building and submitting a return, so
+# that callers can time or profile them.  A hook is an object with
+# enter(name) and exit(name, elapsed) methods, elapsed being in seconds.
+# Stages nest: get_bundle holds load, check_schemas and computations, and
+# submit holds the calls and poll_wait.  In a batch, the stages of
+# different submissions overlap, so the spans open are kept per asyncio
+# task and per thread, and a stage only nests in the stages of its own
+# submission.
+hooks = []
+
+# Names of the spans open in the current task or thread, innermost last
+open_spans = contextvars.ContextVar("open_spans", default=())
+
+# Number of spans open around the current one
+def depth():
+    return len(open_spans.get())
+
+def add_hook(hook):
+    hooks.append(hook)
+
+def remove_hook(hook):
+    hooks.remove(hook)
+
+@contextmanager
+def span(name):
+
+    # Costs next to nothing unless something is listening
+    if not hooks:
+        yield
+        return
+
+    active = list(hooks)
+
+    for hook in active:
+        hook.enter(name)
+
+    token = open_spans.set(open_spans.get() + (name,))
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        open_spans.reset(token)
+        for hook in reversed(active):
+            hook.exit(name, elapsed)
+
+# Decorator which runs a function in a span
+def spanned(name):
+
+    def wrap(fn):
+
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapped
+
+    return wrap
+
+# Totals the time spent in each stage.  Stages are reported in the order
+# they were first entered, indented by how deeply they were nested then.
+class StageTimings:
+
+    def __init__(self):
+        self.order = []
+        self.depths = {}
+        self.totals = {}
+        self.counts = {}
+
+    def enter(self, name):
+        if name not in self.depths:
+            self.order.append(name)
+            self.depths[name] = depth()
+
+    def exit(self, name, elapsed):
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self, out=sys.stderr):
+        out.write("%-32s %8s %12s\n" % ("Stage", "Count", "Seconds"))
+        for name in self.order:
+            out.write("%-32s %8d %12.4f\n" % (
+                "  " * self.depths[name] + name, self.counts[name],
+                self.totals[name]
+            ))
+
+# Peak memory allocated in each stage, over what was allocated when it
+# started, using tracemalloc.  The tracemalloc peak is reset as each stage
+# starts, so a stage's peak is carried up to the stage it is nested in.
+# The peak is shared by the whole process, so this is only meaningful when
+# stages don't overlap, i.e. not in a batch, but the stages open are kept
+# per task and thread as for the spans themselves.
+class StageMemory:
+
+    def __init__(self):
+        self.stack = contextvars.ContextVar("stage_memory", default=())
+        self.order = []
+        self.peaks = {}
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def enter(self, name):
+
+        if name not in self.peaks:
+            self.order.append(name)
+            self.peaks[name] = 0
+
+        current, peak = tracemalloc.get_traced_memory()
+        stack = self.stack.get()
+
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+
+        tracemalloc.reset_peak()
+        self.stack.set(stack + ([current, current],))
+
+    def exit(self, name, elapsed):
+
+        stack = self.stack.get()
+        start, child_peak = stack[-1]
+        stack = stack[:-1]
+        self.stack.set(stack)
+
+        peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+
+        self.peaks[name] = max(self.peaks[name], peak - start)
+
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+
+    def report(self, out=sys.stderr):
+        out.write("%-32s %16s\n" % ("Stage", "Peak bytes"))
+        for name in self.order:
+            out.write("%-32s %16d\n" % (name, self.peaks[name]))
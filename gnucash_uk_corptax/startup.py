@@ -0,0 +1,154 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup cost of the gnucash-uk-corptax modes which don't talk to a
+# gateway.  These are run many times over from other scripts, so time
+# spent importing modules they don't use adds up.  Each mode is run under
+# python -X importtime, and is checked against a budget for the time spent
+# importing, over what a bare interpreter imports, and against a list of
+# modules it should not import at all.  The budgets are in milliseconds
+# and leave room for slower machines; the excluded modules catch an eager
+# import whatever the machine.
+
+# Only wanted for talking to a gateway, or validating against the schemas
+network_modules = [
+    "aiohttp", "asyncio", "xmlschema", "http.server",
+    "gnucash_uk_corptax.client", "gnucash_uk_corptax.validation",
+]
+
+# Only wanted for reading iXBRL
+ixbrl_modules = ["lxml.etree", "ixbrl_parse.ixbrl"]
+
+class Mode:
+    def __init__(self, name, args, budget, excluded):
+        self.name = name
+        self.args = args
+        self.budget = budget
+        self.excluded = excluded
+
+def modes(config, accounts, computations, form_values):
+    return [
+        Mode("help", ["--help"], 30, network_modules + ixbrl_modules),
+        Mode(
+            "output-values", ["--output-values", "-t", computations], 250,
+            network_modules + ["yaml"]
+        ),
+        Mode(
+            "output-form-values", ["--output-form-values", "-t", computations],
+            250, network_modules + ["yaml"]
+        ),
+        Mode(
+            "output-ct", [
+                "--output-ct", "-c", config, "-a", accounts,
+                "-t", computations, "-f", form_values
+            ],
+            300, network_modules
+        ),
+    ]
+
+# Parses python -X importtime output, returns the cumulative microseconds
+# of each module imported at the top level (i.e. not by another module
+# being imported), and the names of all modules imported
+def parse_importtime(text):
+
+    top = {}
+    names = set()
+
+    for line in text.splitlines():
+
+        if not line.startswith("import time:"):
+            continue
+
+        fields = line[len("import time:"):].split("|")
+
+        try:
+            cumulative = int(fields[1])
+        except:
+            # The heading line
+            continue
+
+        name = fields[2].rstrip()
+        names.add(name.strip())
+
+        if not name.startswith("  "):
+            top[name.strip()] = cumulative
+
+    return top, names
+
+def importtime(command):
+
+    start = time.perf_counter()
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+
+    elapsed = time.perf_counter() - start
+    text = proc.stderr.decode("utf-8", errors="replace")
+
+    if proc.returncode != 0:
+        lines = [
+            l for l in text.splitlines() if not l.startswith("import time:")
+        ]
+        raise RuntimeError(
+            "%s failed: %s" % (" ".join(command), "\n".join(lines[-5:]))
+        )
+
+    return parse_importtime(text) + (elapsed,)
+
+# What a bare interpreter imports, and how long it takes to start
+def baseline(repeat=5):
+
+    walls = []
+
+    for i in range(repeat):
+        top, names, elapsed = importtime(["-c", "pass"])
+        walls.append(elapsed)
+
+    return names, statistics.median(walls)
+
+# Runs a mode repeat times, and returns the median import and wall time in
+# milliseconds, and the excluded modules it imported
+def measure(script, mode, base_names, repeat=5):
+
+    imports = []
+    walls = []
+    found = set()
+
+    for i in range(repeat):
+
+        top, names, elapsed = importtime([script] + mode.args)
+
+        imports.append(sum(
+            us for name, us in top.items() if name not in base_names
+        ) / 1000)
+        walls.append(elapsed * 1000)
+
+        found |= set(m for m in mode.excluded if m in names)
+
+    return {
+        "import": statistics.median(imports),
+        "wall": statistics.median(walls),
+        "budget": mode.budget,
+        "excluded-imported": sorted(found),
+    }
+
+# The gnucash-uk-corptax installed alongside the running script
+def script_path():
+
+    here = os.path.dirname(os.path.abspath(sys.argv[0]))
+    path = os.path.join(here, "gnucash-uk-corptax")
+
+    if os.path.exists(path):
+        return path
+
+    for d in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(d, "gnucash-uk-corptax")
+        if os.path.exists(path):
+            return path
+
+    raise RuntimeError("Could not find gnucash-uk-corptax")
@@ -0,0 +1,132 @@
+import datetime
+import re
+
+# Synthetic iXBRL inputs for benchmarking, made by scaling up a sample
+# document such as the accts.html and ct.html in this repository.  Extra
+# contexts are added to the ix:resources, and extra facts referring to
+# them, and padding text, are added at the end of the body.  The extra
+# contexts are all dated before the period of the return, so the facts
+# which make up the return are picked out just as they are from the
+# sample.
+
+# Concept used for the extra facts, which is declared in both the accounts
+# and the computations
+fact_concept = "uk-core:TurnoverRevenue"
+
+padding_text = (
+    "This paragraph is padding added to a synthetic document to increase "
+    "its size, and carries no facts. "
+)
+
+class Scale:
+    def __init__(self, name, facts, contexts, padding):
+        self.name = name
+        self.facts = facts
+        self.contexts = contexts
+        self.padding = padding
+
+# Scales from the sample as it is to tens of megabytes
+scales = {
+    s.name: s
+    for s in [
+        Scale("sample", 0, 0, 0),
+        Scale("small", 1000, 200, 0),
+        Scale("medium", 5000, 1000, 2000000),
+        Scale("large", 20000, 5000, 20000000),
+    ]
+}
+
+def get_scale(name):
+    if name not in scales:
+        raise RuntimeError(
+            "Unknown scale %s, should be one of: %s" % (
+                name, ", ".join(scales)
+            )
+        )
+    return scales[name]
+
+def identifier(doc):
+
+    m = re.search(
+        r'<xbrli:identifier scheme="([^"]*)">([^<]*)</xbrli:identifier>', doc
+    )
+
+    if m is None:
+        raise RuntimeError("Sample document has no entity identifier")
+
+    return m.group(1), m.group(2)
+
+def contexts(doc, count):
+
+    scheme, ident = identifier(doc)
+    last = datetime.date(2019, 12, 31)
+    out = []
+
+    # Alternate instant and one-year period contexts, a day apart
+    for i in range(count):
+
+        end = last - datetime.timedelta(days=i)
+
+        if i % 2:
+            period = "<xbrli:instant>%s</xbrli:instant>" % end
+        else:
+            start = end - datetime.timedelta(days=364)
+            period = (
+                "<xbrli:startDate>%s</xbrli:startDate>"
+                "<xbrli:endDate>%s</xbrli:endDate>" % (start, end)
+            )
+
+        out.append(
+            '<xbrli:context id="synthetic-%d"><xbrli:entity>'
+            '<xbrli:identifier scheme="%s">%s</xbrli:identifier>'
+            '</xbrli:entity><xbrli:period>%s</xbrli:period>'
+            '</xbrli:context>' % (i, scheme, ident, period)
+        )
+
+    return "".join(out)
+
+def facts(count, contexts):
+
+    out = []
+
+    for i in range(count):
+        out.append(
+            '<p><ix:nonFraction name="%s" contextRef="synthetic-%d" '
+            'unitRef="GBP" format="ixt2:numdotdecimal" decimals="2" '
+            'scale="0">%d.%02d</ix:nonFraction></p>' % (
+                fact_concept, i % contexts, 1000 + i, i % 100
+            )
+        )
+
+    return "".join(out)
+
+def padding(size):
+    para = "<p>" + padding_text * 10 + "</p>"
+    return para * (size // len(para))
+
+# Scales up a sample iXBRL document, given as bytes, and returns the
+# synthetic document as bytes
+def generate(sample, scale):
+
+    doc = sample.decode("utf-8")
+
+    if scale.facts and not scale.contexts:
+        raise RuntimeError("Synthetic facts need synthetic contexts")
+
+    if "</ix:resources>" not in doc or "</body>" not in doc:
+        raise RuntimeError("Sample document has no ix:resources or body")
+
+    doc = doc.replace(
+        "</ix:resources>",
+        contexts(doc, scale.contexts) + "</ix:resources>", 1
+    )
+
+    extra = facts(scale.facts, scale.contexts) + padding(scale.padding)
+
+    if extra:
+        doc = doc.replace(
+            "</body>",
+            '<div class="synthetic">' + extra + "</div></body>", 1
+        )
+
+    return doc.encode("utf-8")
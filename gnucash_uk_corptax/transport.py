@@ -0,0 +1,71 @@
+import aiohttp
+
+# Long-lived HTTP transport for gateway traffic.  A single connection
+# pool is shared by submissions, polls and deletes so that connections
+# (and, against the real gateway, TLS sessions) are re-used rather than
+# set up for every message.
+class Transport:
+
+    def __init__(self, limit=100, limit_per_host=10, keepalive=30,
+                 dns_ttl=300, timeout=60):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+
+        if self.session is not None:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl,
+        )
+
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self):
+
+        if self.session is None:
+            return
+
+        await self.session.close()
+        self.session = None
+
+    # Returns HTTP status and response body text.  data is either bytes,
+    # or an iterable of byte strings whose total length is given.
+    async def post(self, ep, data, length=None):
+
+        if self.session is None:
+            raise RuntimeError("Transport is not open")
+
+        headers = {}
+
+        if not isinstance(data, bytes):
+            if length is not None:
+                headers["Content-Length"] = str(length)
+            data = stream(data)
+
+        async with self.session.post(ep, data=data, headers=headers) as resp:
+            return resp.status, await resp.text()
+
+# Feeds pieces to aiohttp, yielding to the event loop between them
+async def stream(pieces):
+    for piece in pieces:
+        yield piece
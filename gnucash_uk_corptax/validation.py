@@ -0,0 +1,275 @@
+from gnucash_uk_corptax.govtalk import GovTalkMessage
+from gnucash_uk_corptax.ixbrl import get_values
+import gnucash_uk_corptax.paths as paths
+
+from lxml import etree as ET
+import base64
+import copy
+import glob
+import hashlib
+import os
+import pickle
+import re
+import sys
+import xmlschema
+
+hints = {
+    "http://www.w3.org/2000/09/xmldsig#": "xmldsig-core-schema.xsd"
+}
+
+schema_dir = "schema"
+ct_schema_file = "CT-2014-v1-96.xsd"
+env_schema_file = "envelope-v2-0-HMRC.xsd"
+
+ct_schema = None
+env_schema = None
+
+# The schemas are loaded once per process, from the first directory asked
+# for, and shared by everything which validates after that
+def load_schemas(directory=None):
+
+    global ct_schema, env_schema
+
+    if directory is None:
+        directory = schema_dir
+
+    if ct_schema is None:
+        ct_schema = compile_schema(os.path.join(directory, ct_schema_file))
+
+    if env_schema is None:
+        env_schema = compile_schema(
+            os.path.join(directory, env_schema_file), locations=hints
+        )
+
+def cache_dir():
+    base = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(base, "gnucash-uk-corptax", "schemas")
+
+# Key for a compiled schema: the content of every XSD alongside it (which
+# covers anything it includes or imports), how it is loaded, and the
+# xmlschema and Python versions the pickle depends on.
+def schema_key(path, base_url, locations):
+
+    h = hashlib.sha256()
+
+    h.update(repr((
+        os.path.basename(path), base_url, sorted((locations or {}).items()),
+        xmlschema.__version__, sys.version_info[:2]
+    )).encode("utf-8"))
+
+    xsds = glob.glob(os.path.join(os.path.dirname(path) or ".", "*.xsd"))
+
+    for xsd in sorted(xsds):
+        h.update(os.path.basename(xsd).encode("utf-8"))
+        with open(xsd, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+
+    return h.hexdigest()
+
+# Compiling the CT schema takes a large part of a second, loading it
+# pickled takes a few milliseconds.  Compiled schemas are cached on disk
+# under a key derived from the XSD content, so an edited schema is
+# compiled afresh.  The cache is only an optimisation: if it can't be read
+# or written, the schema is compiled as normal.
+def compile_schema(path, base_url=None, locations=None):
+
+    try:
+        key = schema_key(path, base_url, locations)
+        cached = os.path.join(cache_dir(), key + ".pickle")
+    except Exception as e:
+        raise RuntimeError("Could not read schema %s: %s" % (path, str(e)))
+
+    try:
+        with open(cached, "rb") as f:
+            return pickle.load(f)
+    except:
+        pass
+
+    schema = xmlschema.XMLSchema(path, base_url=base_url, locations=locations)
+
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        tmp = "%s.%d.tmp" % (cached, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(schema, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cached)
+    except:
+        pass
+
+    return schema
+
+# Process pool initializer, so that each worker loads the schemas once
+# rather than for every submission
+def init_worker():
+    load_schemas()
+
+# Outcome of checking a submission.  report is the lines describing the
+# submission, for the service log.
+class Validation:
+    def __init__(self):
+        self.report = []
+        self.irmark_valid = False
+        self.ct_valid = False
+        self.envelope_valid = False
+
+    # Messages for the success response
+    def messages(self):
+
+        msgs = []
+
+        if self.irmark_valid:
+            msgs.append("IRmark is valid.")
+        else:
+            msgs.append("IRmark is invalid.")
+
+        if self.ct_valid:
+            msgs.append("Corporation tax validates against schema.")
+        else:
+            msgs.append("Corporation tax body is not valid.")
+
+        if self.envelope_valid:
+            msgs.append("Envelope validates against schema.")
+        else:
+            msgs.append("Envelope is not valid.")
+
+        return msgs
+
+# Checks a submission request, given the message as received.  This is
+# CPU-bound and runs in a worker process: the IRmark is verified, embedded
+# documents are decoded, and the return and envelope are validated against
+# the schemas.
+def check_submission(data):
+
+    load_schemas()
+
+    v = Validation()
+
+    def report(*args):
+        v.report.append(" ".join(str(a) for a in args))
+
+    msg = GovTalkMessage.decode(data)
+    ire = msg.ir_envelope()
+
+    # The schemas are checked in memory against the message as rebuilt from
+    # what was received, which is the tree a client builds to send
+    root = msg.create_message().getroot()
+    ct_error = validate(ct_schema, ire)
+    env_error = validate(env_schema, root)
+
+    for elt in paths.irmark(ire):
+        report("  %-20s: %s" % ("IRmark", elt.text))
+
+    ts = msg.get("timestamp")
+    if ts:
+        report("  %-20s: %s" % ("Timestamp", ts))
+
+    for text in paths.company_name(ire):
+        report("  %-20s: %s" % ("Company", text))
+
+    for text in paths.reference(ire):
+        report("  %-20s: %s" % ("UTR", text))
+
+    for text in paths.chargeable_profits(ire):
+        report("  %-20s: %10.2f" % ("Profit", float(text)))
+
+    for text in paths.turnover(ire):
+        report("  %-20s: %10.2f" % ("Turnover", float(text)))
+
+    for text in paths.tax_payable(ire):
+        report("  %-20s: %10.2f" % ("Tax payable", float(text)))
+
+    for text in paths.period_from(ire):
+        report("  %-20s: %s" % ("Start of period", text))
+
+    for text in paths.period_to(ire):
+        report("  %-20s: %s" % ("End of period", text))
+
+    for elt in paths.computations_document(ire):
+        doc = ET.fromstring(base64.b64decode(elt.text))
+        vals = get_values(doc)
+        report("Computations document has %d facts" % len(vals))
+
+    for elt in paths.accounts_document(ire):
+        doc = ET.fromstring(base64.b64decode(elt.text))
+        vals = get_values(doc)
+        report("Accounts document has %d facts" % len(vals))
+
+    try:
+        msg.verify_irmark()
+        report("IRmark is valid.")
+        v.irmark_valid = True
+    except Exception as e:
+        report("Exception:", e)
+        report("IRmark is invalid")
+
+    if ct_error is None:
+        report("Corporation tax validates against schema.")
+        v.ct_valid = True
+    else:
+        report("Corporation tax body is not valid.")
+        report(ct_error)
+
+    if env_error is None:
+        report("Envelope validates against schema.")
+        v.envelope_valid = True
+    else:
+        report("Envelope is not valid.")
+        report(env_error)
+
+    return v
+
+# Validates an element against a schema, returns None if it is valid, or
+# the reason it isn't
+def validate(schema, elt):
+    try:
+        schema.validate(elt)
+        return None
+    except Exception as e:
+        return str(e)
+
+# Short description of why an element is invalid, for reporting problems
+# with a return before it is sent
+def describe(e):
+    reason = getattr(e, "reason", None)
+    path = getattr(e, "path", None)
+    if reason is None:
+        return str(e).split("\n")[0]
+    if path:
+        return "%s (at %s)" % (reason, re.sub(r"\{[^}]*\}", "", path))
+    return reason
+
+# Checks a GovTalk message against the schemas before it is sent, and
+# returns the problems found, an empty list if there are none.  Embedded
+# documents are only base64 encoded as the message is output, so the
+# message tree holds a token in place of each.  The check runs on a copy
+# with the tokens left empty, which is small as it holds none of the
+# documents.
+def preflight(msg, directory=None):
+
+    load_schemas(directory)
+
+    root = msg.create_message().getroot()
+    tokens = set(p.token for p in msg.payloads())
+
+    if tokens:
+        root = copy.deepcopy(root)
+        for elt in root.iter():
+            if elt.text in tokens:
+                elt.text = ""
+
+    problems = []
+
+    for ire in paths.ir_envelope(root):
+        try:
+            ct_schema.validate(ire)
+        except Exception as e:
+            problems.append("Corporation tax body: " + describe(e))
+
+    try:
+        env_schema.validate(root)
+    except Exception as e:
+        problems.append("Envelope: " + describe(e))
+
+    return problems
@@ -18,7 +18,7 @@ setuptools.setup(
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     download_url = "https://github.com/cybermaggedon/gnucash-uk-corptax/archive/refs/tags/v1.3.0.tar.gz",
     install_requires=[
         'aiohttp',
@@ -28,6 +28,8 @@ setuptools.setup(
     ],
     scripts=[
         "scripts/gnucash-uk-corptax",
-        "scripts/corptax-test-service"
+        "scripts/corptax-test-service",
+        "scripts/corptax-benchmark",
+        "scripts/corptax-startup"
     ]
 )
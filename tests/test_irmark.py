@@ -0,0 +1,160 @@
+from gnucash_uk_corptax.corptax import get_govtalk_message
+from gnucash_uk_corptax.govtalk import GovTalkMessage
+from gnucash_uk_corptax.inputs import load_accts, load_comps, load_bundle
+import gnucash_uk_corptax.irmark as irmark
+
+from lxml import etree as ET
+import base64
+import copy
+import hashlib
+import io
+import os
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.dirname(here)
+
+env_ns = irmark.env_ns
+ct_ns = irmark.ct_ns
+
+# The IRmark as it used to be computed, with lxml's C14N: the Body copied
+# with its IRmark removed, serialised, parsed, its children copied under a
+# new Body declaring the envelope and CT namespaces, and canonicalised
+def reference(body):
+
+    bc = copy.deepcopy(body)
+    for hdr in bc.findall(".//{%s}IRheader" % ct_ns):
+        for mark in hdr.findall("{%s}IRmark" % ct_ns):
+            hdr.remove(mark)
+
+    pre = io.BytesIO()
+    ET.ElementTree(bc).write(pre, encoding="utf-8", xml_declaration=False)
+
+    root = ET.fromstring(pre.getvalue())
+    elt = ET.Element(root.tag, nsmap={None: env_ns, "ct": ct_ns})
+    for se in root:
+        elt.append(copy.deepcopy(se))
+
+    out = io.BytesIO()
+    ET.ElementTree(elt).write_c14n(out)
+
+    return base64.b64encode(hashlib.sha1(out.getvalue()).digest()).decode()
+
+def body(xml):
+    return ET.fromstring(xml).find("{%s}Body" % env_ns)
+
+def message(content, outer="", body_attrs=""):
+    return (
+        '<GovTalkMessage xmlns="%s" xmlns:ct="%s"%s><Body%s>%s</Body>'
+        '</GovTalkMessage>' % (env_ns, ct_ns, outer, body_attrs, content)
+    )
+
+cases = {
+    "prefixed": message(
+        '<ct:IRenvelope><ct:IRheader><ct:IRmark Type="generic">x</ct:IRmark>'
+        '<ct:A>1</ct:A></ct:IRheader></ct:IRenvelope>'
+    ),
+    "default namespace": message(
+        '<IRenvelope xmlns="%s"><IRheader><IRmark>x</IRmark><A>1</A>'
+        '</IRheader></IRenvelope>' % ct_ns
+    ),
+    "default namespace redeclared": message(
+        '<IRenvelope xmlns="%s"><A><B xmlns="%s">1</B></A></IRenvelope>' % (
+            ct_ns, ct_ns
+        )
+    ),
+    "other prefix": message(
+        '<c:IRenvelope xmlns:c="%s"><c:A>1</c:A></c:IRenvelope>' % ct_ns
+    ),
+    "foreign namespace on child": message(
+        '<ct:IRenvelope><ct:A xmlns:q="urn:q"><q:B>1</q:B></ct:A>'
+        '</ct:IRenvelope>'
+    ),
+    "foreign namespace unused": message(
+        '<ct:IRenvelope><ct:A xmlns:q="urn:q">1</ct:A></ct:IRenvelope>'
+    ),
+    "foreign namespace two prefixes": message(
+        '<ct:IRenvelope><ct:A xmlns:q="urn:q"><r:B xmlns:r="urn:q" r:x="1">'
+        '1</r:B></ct:A></ct:IRenvelope>'
+    ),
+    "foreign namespace shadowed": message(
+        '<ct:IRenvelope><ct:A xmlns:q="urn:q"><q:B xmlns:q="urn:r"><q:C/>'
+        '</q:B></ct:A><q:D xmlns:q="urn:q"/></ct:IRenvelope>'
+    ),
+    "foreign namespace with default": message(
+        '<IRenvelope xmlns="%s"><A xmlns:q="urn:q"><q:B>1</q:B><C/></A>'
+        '</IRenvelope>' % ct_ns
+    ),
+    "foreign attribute": message(
+        '<ct:IRenvelope xmlns:q="urn:q"><ct:A q:b="1">1</ct:A>'
+        '</ct:IRenvelope>'
+    ),
+    "xml:lang": message(
+        '<ct:IRenvelope><ct:A xml:lang="en">1</ct:A></ct:IRenvelope>'
+    ),
+    "namespace above Body": message(
+        '<ct:IRenvelope><q:B>1</q:B></ct:IRenvelope>',
+        outer=' xmlns:q="urn:q"'
+    ),
+    "namespace above Body unused": message(
+        '<ct:IRenvelope><ct:B>1</ct:B></ct:IRenvelope>',
+        outer=' xmlns:q="urn:q"'
+    ),
+    "namespace on Body": message(
+        '<ct:IRenvelope><q:B>1</q:B></ct:IRenvelope>',
+        body_attrs=' xmlns:q="urn:q"'
+    ),
+    "envelope under a prefix": (
+        '<e:GovTalkMessage xmlns:e="%s" xmlns:ct="%s"><e:Body>'
+        '<ct:IRenvelope><e:X>1</e:X></ct:IRenvelope></e:Body>'
+        '</e:GovTalkMessage>' % (env_ns, ct_ns)
+    ),
+    "pretty printed and escaped": message(
+        '\n  <ct:IRenvelope>\n    <ct:A a="x&amp;y" b="z">1 &lt; 2\r</ct:A>'
+        '\n  </ct:IRenvelope>\n'
+    ),
+    "comment": message(
+        '<!-- hi --><ct:IRenvelope><ct:A>1</ct:A></ct:IRenvelope>'
+    ),
+}
+
+@pytest.mark.parametrize("name", sorted(cases))
+def test_digest_matches_c14n(name):
+    b = body(cases[name])
+    assert irmark.digest(b) == reference(b)
+
+def test_attribute_in_default_namespace_is_refused():
+    b = body(message(
+        '<ct:IRenvelope><ct:A xmlns:q="%s"><q:B q:y="2">1</q:B></ct:A>'
+        '</ct:IRenvelope>' % env_ns
+    ))
+    with pytest.raises(RuntimeError):
+        irmark.digest(b)
+
+def sample(name):
+    return os.path.join(top, name)
+
+@pytest.mark.parametrize("form_values", [
+    "form-values.yaml", "many-values.yaml", "all-values.yaml"
+])
+def test_sample_messages_match_c14n(form_values):
+
+    bundle = load_bundle(
+        sample("config.json"), load_accts(sample("accts.html")),
+        load_comps(sample("ct.html")), sample(form_values), None
+    )
+
+    payloads = []
+    rtn = bundle.get_return(payloads)
+    utr = str(bundle.form_values["ct600"][3])
+
+    req = get_govtalk_message(bundle.params, utr, rtn, payloads)
+    req.add_irmark()
+    data = req.toxml()
+
+    # As sent, with the embedded documents encoded
+    assert req.get_irmark() == reference(body(data))
+
+    # As received
+    msg = GovTalkMessage.decode(data)
+    msg.verify_irmark()
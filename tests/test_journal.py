@@ -0,0 +1,99 @@
+import gnucash_uk_corptax.client as client
+import gnucash_uk_corptax.journal as journal
+
+import asyncio
+import pytest
+
+@pytest.fixture
+def jnl(tmp_path):
+    return journal.Journal(str(tmp_path / "journal.db"))
+
+def previous(jnl, state, correlation_id="1E240"):
+    record = jnl.add("Example", "config.json", "http://x/", "123", "mark")
+    record.update(state=state, correlation_id=correlation_id)
+    return record
+
+def refusal(jnl):
+    with pytest.raises(RuntimeError) as e:
+        client.journal_submission(
+            jnl, "Example", "config.json", {"url": "http://x/"}, "123", "mark"
+        )
+    return str(e.value)
+
+@pytest.mark.parametrize("state", [journal.SUBMITTED, journal.RESPONDED])
+def test_acknowledged_suggests_resume(jnl, state):
+    previous(jnl, state)
+    assert "--resume" in refusal(jnl)
+
+def test_completed_reports_completion(jnl):
+    previous(jnl, journal.COMPLETED)
+    message = refusal(jnl)
+    assert "completed" in message
+    assert "--resume" not in message
+
+@pytest.mark.parametrize("state", [journal.SUBMITTING, journal.UNKNOWN])
+def test_unknown_does_not_suggest_resume(jnl, state):
+    previous(jnl, state, None)
+    message = refusal(jnl)
+    assert "not known" in message
+    assert "--resume" not in message
+
+def test_failed_is_submitted_again(jnl):
+    previous(jnl, journal.FAILED)
+    record = client.journal_submission(
+        jnl, "Example", "config.json", {"url": "http://x/"}, "123", "mark"
+    )
+    assert record.state == journal.SUBMITTING
+
+# A poller whose submission is turned down by the gateway, or never answers
+class Poller:
+
+    def __init__(self, e):
+        self.e = e
+
+    async def wait(self, correlation_id, endpoint, interval, timeout, poll):
+        raise self.e
+
+class Entry:
+    name = "Example"
+
+def resume(jnl, tmp_path, e):
+
+    config = tmp_path / "config.json"
+    config.write_text('{"username": "u", "password": "p", '
+                      '"gateway-test": "1"}')
+
+    record = jnl.add("Example", str(config), "http://x/", "123", "mark")
+    record.update(
+        state=journal.SUBMITTED, correlation_id="1E240",
+        endpoint="http://x/poll", poll_interval=1.0
+    )
+
+    entry = Entry()
+    asyncio.run(client.resume_entry(
+        None, Poller(e), record, entry, asyncio.Semaphore(1), 1
+    ))
+
+    assert entry.status == "failed"
+    return jnl.find_irmark("mark")
+
+def test_gateway_error_fails_submitted(jnl):
+    record = previous(jnl, journal.SUBMITTED)
+    client.journal_failure(record, client.GatewayError("Rejected"))
+    assert record.state == journal.FAILED
+
+def test_transport_error_leaves_submitted(jnl):
+    record = previous(jnl, journal.SUBMITTED)
+    client.journal_failure(record, RuntimeError("Timeout"))
+    assert record.state == journal.SUBMITTED
+
+def test_gateway_error_while_resuming_fails(jnl, tmp_path):
+    assert resume(jnl, tmp_path, client.GatewayError("Rejected")) == []
+    client.journal_submission(
+        jnl, "Example", "config.json", {"url": "http://x/"}, "123", "mark"
+    )
+
+def test_timeout_while_resuming_stays_outstanding(jnl, tmp_path):
+    prev = resume(jnl, tmp_path, RuntimeError("Timeout"))
+    assert prev[0].state == journal.SUBMITTED
+    assert prev[0].message == "Timeout"
@@ -0,0 +1,85 @@
+from gnucash_uk_corptax.spans import (
+    span, add_hook, remove_hook, StageTimings, StageMemory
+)
+
+import asyncio
+import concurrent.futures
+import time
+
+def timed(hook, fn):
+    add_hook(hook)
+    try:
+        fn()
+    finally:
+        remove_hook(hook)
+    return hook
+
+def test_nesting():
+
+    def run():
+        with span("outer"):
+            with span("inner"):
+                pass
+        with span("other"):
+            pass
+
+    t = timed(StageTimings(), run)
+
+    assert t.order == ["outer", "inner", "other"]
+    assert t.depths == {"outer": 0, "inner": 1, "other": 0}
+    assert t.counts == {"outer": 1, "inner": 1, "other": 1}
+
+# Stages of concurrent tasks overlap, but only nest in their own task's
+def test_concurrent_tasks():
+
+    async def entry(n):
+        with span("submit"):
+            await asyncio.sleep(0.01 * n)
+            with span("call"):
+                await asyncio.sleep(0.01)
+        with span("summary"):
+            pass
+
+    async def batch():
+        await asyncio.gather(*[entry(n) for n in range(5)])
+
+    t = timed(StageTimings(), lambda: asyncio.run(batch()))
+
+    assert t.depths == {"submit": 0, "call": 1, "summary": 0}
+    assert t.counts == {"submit": 5, "call": 5, "summary": 5}
+
+def test_concurrent_threads():
+
+    def build(n):
+        with span("build"):
+            time.sleep(0.01)
+            with span("irmark"):
+                time.sleep(0.01)
+
+    def run():
+        with concurrent.futures.ThreadPoolExecutor(4) as ex:
+            list(ex.map(build, range(8)))
+
+    t = timed(StageTimings(), run)
+
+    assert t.depths == {"build": 0, "irmark": 1}
+    assert t.counts == {"build": 8, "irmark": 8}
+
+def test_memory():
+
+    def run():
+        with span("outer"):
+            with span("inner"):
+                data = bytearray(1000000)
+            del data
+
+    m = StageMemory()
+    m.start()
+    try:
+        timed(m, run)
+    finally:
+        m.stop()
+
+    assert m.order == ["outer", "inner"]
+    assert m.peaks["inner"] >= 1000000
+    assert m.peaks["outer"] >= m.peaks["inner"]
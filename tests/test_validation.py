@@ -0,0 +1,60 @@
+from gnucash_uk_corptax.corptax import get_govtalk_message
+from gnucash_uk_corptax.inputs import load_accts, load_comps, load_bundle
+import gnucash_uk_corptax.validation as validation
+
+import os
+
+here = os.path.dirname(os.path.abspath(__file__))
+top = os.path.dirname(here)
+
+def sample(name):
+    return os.path.join(top, name)
+
+# A signed submission built from the sample files and the given form values
+def signed(form_values):
+
+    bundle = load_bundle(
+        sample("config.json"), load_accts(sample("accts.html")),
+        load_comps(sample("ct.html")), sample(form_values), None
+    )
+
+    payloads = []
+    rtn = bundle.get_return(payloads)
+    utr = str(bundle.form_values["ct600"][3])
+
+    req = get_govtalk_message(bundle.params, utr, rtn, payloads)
+    req.add_irmark()
+
+    return req
+
+def test_preflight_passes_valid_return():
+    req = signed("many-values.yaml")
+    assert validation.preflight(req, sample("schema")) == []
+
+def test_preflight_reports_invalid_return():
+    req = signed("form-values.yaml")
+    problems = validation.preflight(req, sample("schema"))
+    assert len(problems) == 1
+    assert problems[0].startswith("Corporation tax body:")
+    assert "TaxRate" in problems[0]
+
+def test_preflight_leaves_message_unchanged():
+    req = signed("many-values.yaml")
+    before = req.toxml()
+    validation.preflight(req, sample("schema"))
+    assert req.toxml() == before
+
+def test_built_envelope_is_namespaced():
+    req = signed("many-values.yaml")
+    root = req.create_message().getroot()
+    for elt in root.iter():
+        if isinstance(elt.tag, str):
+            assert elt.tag.startswith("{"), elt.tag
+
+def test_service_check_agrees_with_preflight():
+    validation.load_schemas(sample("schema"))
+    req = signed("many-values.yaml")
+    v = validation.check_submission(req.toxml())
+    assert v.irmark_valid
+    assert v.ct_valid
+    assert v.envelope_valid